@@ -1,8 +1,20 @@
 
+import sqlite3
+
 import streamlit as st
 import matplotlib.pyplot as plt
 import numpy as np
 
+import ablation
+import calibration
+import cornea_trace
+import plan_store
+import power_vector
+import topo_import
+import zoom_engine
+import zoom_optics
+from zoom_engine import expected_dof_over_pupil, feasible_region, monte_carlo_plan, robust_plans, suggest_plans
+
 st.set_page_config(page_title="ZOOM Simulator - CAMP Algorithm", layout="wide")
 
 # App Title and Subtitle
@@ -19,18 +31,27 @@ st.sidebar.header("🔎 Refraction (RE & LE)")
 # Right Eye
 re_sphere = st.sidebar.number_input("RE Sphere (D)", -10.0, 10.0, 0.0, 0.25, key="re_sphere")
 re_cyl = st.sidebar.number_input("RE Cylinder (D)", -6.0, 0.0, 0.0, 0.25, key="re_cyl")
+re_axis = st.sidebar.number_input("RE Axis (°)", 0, 180, 180, 1, key="re_axis")
+re_M, re_J0, re_J45 = (float(v) for v in power_vector.to_power_vector(re_sphere, re_cyl, re_axis))
 actual_re = re_sphere  # use this as earlier "actual RE refraction"
-se_re = re_sphere + (re_cyl / 2)
+se_re = re_M  # spherical equivalent, re_sphere + (re_cyl / 2)
 
 # Left Eye
 le_sphere = st.sidebar.number_input("LE Sphere (D)", -10.0, 10.0, 0.0, 0.25, key="le_sphere")
 le_cyl = st.sidebar.number_input("LE Cylinder (D)", -6.0, 0.0, 0.0, 0.25, key="le_cyl")
+le_axis = st.sidebar.number_input("LE Axis (°)", 0, 180, 180, 1, key="le_axis")
+le_M, le_J0, le_J45 = (float(v) for v in power_vector.to_power_vector(le_sphere, le_cyl, le_axis))
 actual_le = le_sphere  # use this as earlier "actual LE refraction"
-se_le = le_sphere + (le_cyl / 2)
+se_le = le_M  # spherical equivalent, le_sphere + (le_cyl / 2)
+
+st.sidebar.header("📥 Topolyzer Elevation Import")
+
+topo_import.topography_sidebar(("sa", "radius", "base_q"))
 
 st.sidebar.header("🌀 Preop Corneal Spherical Aberration (6mm)")
 sa_re = st.sidebar.number_input("RE Corneal SA (μm)", min_value=0.00, max_value=1.00, value=0.00, step=0.01, key="sa_re")
 sa_le = st.sidebar.number_input("LE Corneal SA (μm)", min_value=0.00, max_value=1.00, value=0.00, step=0.01, key="sa_le")
+pupil_profile = st.sidebar.selectbox("Pupil Profile", ["Fixed 3 mm", "photopic", "mesopic"], key="pupil_profile")
 
 
 st.sidebar.header("🔍 BIA and Q Modulation Settings")
@@ -48,19 +69,45 @@ monovision_add = st.sidebar.slider("Monovision Add (D)", 0.0, 1.5, 0.0, 0.25)
 
 show_overlap = st.sidebar.checkbox("🔷 Show Binocular Overlap", value=False)
 
+st.sidebar.header("🧪 Corneal Tissue")
+re_k = st.sidebar.number_input("RE Preop K (D)", 38.0, 50.0, 43.5, 0.25, key="re_k")
+le_k = st.sidebar.number_input("LE Preop K (D)", 38.0, 50.0, 43.5, 0.25, key="le_k")
+re_pachy = st.sidebar.number_input("RE Pachymetry (μm)", 400, 700, 540, 5, key="re_pachy")
+le_pachy = st.sidebar.number_input("LE Pachymetry (μm)", 400, 700, 540, 5, key="le_pachy")
+flap_thickness = st.sidebar.number_input("Flap Thickness (μm)", 80, 160, 110, 5, key="flap_thickness")
+
+st.sidebar.header("📐 Traced Q→DOF (optional)")
+use_traced_q = st.sidebar.checkbox("Use ray-traced Q→DOF instead of the calibrated factor", value=False, key="use_traced_q")
+if use_traced_q:
+    re_radius = st.sidebar.number_input("RE Anterior Corneal Radius (mm)", 6.5, 9.5, 7.8, 0.05, key="re_radius")
+    re_base_q = st.sidebar.number_input("RE Baseline Q", -1.5, 1.0, -0.2, 0.01, key="re_base_q")
+    le_radius = st.sidebar.number_input("LE Anterior Corneal Radius (mm)", 6.5, 9.5, 7.8, 0.05, key="le_radius")
+    le_base_q = st.sidebar.number_input("LE Baseline Q", -1.5, 1.0, -0.2, 0.01, key="le_base_q")
+
+# Calibrated coefficients (latest version written by calibration.py, else the original literals)
+dof_coefficients, dof_coefficients_version = calibration.load_coefficients(with_version=True)
+
+# Bootstrap samples are fitted offline by calibration.py --bootstrap; the page only reads them
+st.sidebar.header("📊 DOF Confidence Bands (optional)")
+dof_bootstrap_path = calibration.bootstrap_path(dof_coefficients_version)
+show_dof_ci = st.sidebar.checkbox("Show bootstrap interval of the predicted DOF", value=False, key="show_dof_ci",
+                                  disabled=dof_bootstrap_path is None) and dof_bootstrap_path is not None
+if dof_bootstrap_path is None:
+    st.sidebar.caption("No bootstrap samples for the current coefficient set; run calibration.py with --bootstrap N.")
+
 # Q to DOF conversion
-def get_dof_from_se(se, sa_preop, pupil=3.0, k=1.5):
+def get_dof_from_se(se, sa_preop, pupil=3.0, k=dof_coefficients["sa_k"]):
     if se == 0:
         return 0
-    dof = (0.25 * se) * (4 / pupil)**2 * (1 - k * sa_preop)
+    dof = (dof_coefficients["se_slope"] * se) * (dof_coefficients["pupil_ref"] / pupil)**dof_coefficients["pupil_exponent"] * (1 - k * sa_preop)
     dof = max(dof, 0)
     return round(dof * 4) / 4
 
-q_to_dof = 1.25 / 0.3
+q_to_dof = dof_coefficients["q_to_dof"]
 
 
-def plot_eye(ax, label, q_delta, bia, refraction, monovision, show_overlap=False, other_eye_dof=None, se_dof=0):
-    q_dof = q_delta * q_to_dof
+def plot_eye(ax, label, q_delta, bia, refraction, monovision, show_overlap=False, other_eye_dof=None, se_dof=0, q_dof_factor=q_to_dof, se_dof_ci=None):
+    q_dof = q_delta * q_dof_factor
     net_shift = refraction + monovision
 
     retina_x = 0
@@ -95,6 +142,11 @@ def plot_eye(ax, label, q_delta, bia, refraction, monovision, show_overlap=False
     ax.fill_betweenx([-0.4, 0.4], q_start, q_end, color='green', alpha=0.3)
     ax.text(-2.5, 1.7, label, fontsize=11, weight='bold')
 
+    if se_dof_ci is not None:
+        # Bootstrap interval of the predicted (unrounded) DOF, measured from the red bar's start
+        ci_low, ci_high = se_dof_ci
+        ax.errorbar(se_start - (ci_low + ci_high) / 2, 0, xerr=(ci_high - ci_low) / 2, fmt='none', ecolor='darkred', elinewidth=1.5, capsize=6)
+
     if show_overlap:
         return (bia_end, q_end)
     return None
@@ -138,11 +190,29 @@ re_mono = monovision_add if monovision_eye == "Right Eye" else 0
 le_mono = monovision_add if monovision_eye == "Left Eye" else 0
 
 
-re_se_dof = get_dof_from_se(se_re, sa_re)
-le_se_dof = get_dof_from_se(se_le, sa_le)
+if pupil_profile == "Fixed 3 mm":
+    re_se_dof = get_dof_from_se(se_re, sa_re)
+    le_se_dof = get_dof_from_se(se_le, sa_le)
+else:
+    # Expected DOF over the selected pupil-size distribution
+    pupil_coefficients = zoom_engine.se_dof_kwargs(dof_coefficients)
+    re_se_dof = float(expected_dof_over_pupil(se_re, sa_re, pupil_profile, **pupil_coefficients))
+    le_se_dof = float(expected_dof_over_pupil(se_le, sa_le, pupil_profile, **pupil_coefficients))
+
+if use_traced_q:
+    re_q_factor = cornea_trace.traced_q_to_dof(re_radius, re_base_q, re_q)
+    le_q_factor = cornea_trace.traced_q_to_dof(le_radius, le_base_q, le_q)
+else:
+    re_q_factor = le_q_factor = q_to_dof
 
-re_dof = plot_eye(axs[0], f"Right Eye (Q Δ {re_q:.2f})", re_q, bia, re_refraction, re_mono, show_overlap, se_dof=re_se_dof)
-le_dof = plot_eye(axs[1], f"Left Eye (Q Δ {le_q:.2f})", le_q, bia, le_refraction, le_mono, show_overlap, se_dof=le_se_dof)
+re_dof_ci = le_dof_ci = None
+if show_dof_ci:
+    ci_pupil = 3.0 if pupil_profile == "Fixed 3 mm" else pupil_profile
+    re_dof_ci = calibration.dof_interval(dof_bootstrap_path, sa_re, se=se_re, pupil=ci_pupil)
+    le_dof_ci = calibration.dof_interval(dof_bootstrap_path, sa_le, se=se_le, pupil=ci_pupil)
+
+re_dof = plot_eye(axs[0], f"Right Eye (Q Δ {re_q:.2f})", re_q, bia, re_refraction, re_mono, show_overlap, se_dof=re_se_dof, q_dof_factor=re_q_factor, se_dof_ci=re_dof_ci)
+le_dof = plot_eye(axs[1], f"Left Eye (Q Δ {le_q:.2f})", le_q, bia, le_refraction, le_mono, show_overlap, se_dof=le_se_dof, q_dof_factor=le_q_factor, se_dof_ci=le_dof_ci)
 
 if show_overlap and re_dof and le_dof:
     start_overlap = max(re_dof[0], le_dof[0])
@@ -157,10 +227,13 @@ if show_overlap and re_dof and le_dof:
 
 plt.tight_layout()
 st.pyplot(fig)
+plt.close(fig)
 
 # Cautionary Note Below Plot
 st.markdown("#### ⚠️ Disclaimer")
 st.markdown("These ray diagrams are intended only to assist with **preoperative planning and optimization**. Actual postoperative results may vary depending on healing patterns, patient-specific factors, and surgical technique. **Surgeon must use discretion and accept responsibility for interpretation and usage.**")
+if dof_coefficients_version:
+    st.caption(f"DOF coefficients: calibrated set v{dof_coefficients_version}")
 
 
 
@@ -176,6 +249,164 @@ st.write(f"**Left Eye Final Refraction Sphere:** {final_le_sphere:.2f} D")
 st.write(f"**Right Eye Final Q Value Change:** ΔQ = {re_q:.2f}")
 st.write(f"**Left Eye Final Q Value Change:** ΔQ = {le_q:.2f}")
 
+for eye_name, M, J0, J45 in (("Right Eye", re_M, re_J0, re_J45), ("Left Eye", le_M, le_J0, le_J45)):
+    st.write(f"**{eye_name} Power Vector:** M = {M:.2f} D, J0 = {J0:.2f} D, J45 = {J45:.2f} D, "
+             f"blur strength = {float(power_vector.blur_strength(M, J0, J45)):.2f} D")
+
+# Tissue cost over the 6.0 mm OZ (9.0 mm total zone); baseline Q from the traced inputs when given
+tissue = ablation.ablation_summary(
+    [final_re_sphere, final_le_sphere], [re_k, le_k],
+    [re_base_q, le_base_q] if use_traced_q else -0.2, [re_q, le_q], [re_cyl, le_cyl], [re_axis, le_axis])
+for eye_idx, eye_name in enumerate(["Right Eye", "Left Eye"]):
+    st.write(f"**{eye_name} Ablation:** max depth {tissue['max_depth'][eye_idx]:.1f} μm, "
+             f"transition zone {tissue['tz_depth'][eye_idx]:.1f} μm, volume {tissue['volume'][eye_idx]:.2f} mm³")
+
+safety = ablation.screen_plans([final_re_sphere, final_le_sphere], [re_k, le_k], [re_pachy, le_pachy],
+                               flap=flap_thickness, ablation_depth=tissue['max_depth'], cyl=[re_cyl, le_cyl])
+for eye_idx, eye_name in enumerate(["Right Eye", "Left Eye"]):
+    st.write(f"**{eye_name} Postop K:** {safety['postop_k'][eye_idx]:.2f} D, "
+             f"**PTA:** {safety['pta'][eye_idx]:.1%}, **Residual Bed:** {safety['rsb'][eye_idx]:.0f} μm")
+    if safety['k_flag'][eye_idx]:
+        st.warning(f"⚠️ {eye_name}: predicted postop K outside {ablation.safety_limits['min_postop_k']:.0f}–{ablation.safety_limits['max_postop_k']:.0f} D")
+    if safety['pta_flag'][eye_idx]:
+        st.warning(f"⚠️ {eye_name}: percent tissue altered above {ablation.safety_limits['max_pta']:.0%}")
+    if safety['rsb_flag'][eye_idx]:
+        st.warning(f"⚠️ {eye_name}: residual stromal bed below {ablation.safety_limits['min_rsb']:.0f} μm")
+
+
+@st.cache_resource
+def open_plan_store():
+    return plan_store.PlanStore()
+
+
+re_plan_bars = zoom_engine.bar_endpoints(re_q, bia, re_refraction, re_mono, re_se_dof, re_q_factor)
+le_plan_bars = zoom_engine.bar_endpoints(le_q, bia, le_refraction, le_mono, le_se_dof, le_q_factor)
+plan_overlap = float(zoom_engine.binocular_overlap(re_plan_bars[3], re_plan_bars[5], le_plan_bars[3], le_plan_bars[5])[2])
+plan_patient = st.text_input("Patient ID for this plan", key="plan_patient_id")
+if st.button("💾 Save Plan", disabled=not plan_patient, key="save_plan"):
+    plan = {
+        "re": {"sphere": re_sphere, "cyl": re_cyl, "axis": re_axis, "sa": sa_re, "q_delta": re_q, "refraction_add": re_refraction,
+               "monovision_add": re_mono, "se_dof": re_se_dof, "final_sphere": final_re_sphere},
+        "le": {"sphere": le_sphere, "cyl": le_cyl, "axis": le_axis, "sa": sa_le, "q_delta": le_q, "refraction_add": le_refraction,
+               "monovision_add": le_mono, "se_dof": le_se_dof, "final_sphere": final_le_sphere},
+        "bia": bia,
+        "pupil_profile": pupil_profile,
+        "dof_coefficients_version": dof_coefficients_version,
+    }
+    # Saved before the list below is read, so the new plan shows up and failures are reported
+    try:
+        plan_id = open_plan_store().save_plan(
+            plan_patient, "hyperopic", plan, poor_fusion=bool(zoom_engine.is_poor_fusion(plan_overlap)),
+            overlap=plan_overlap, re_final_sphere=final_re_sphere, le_final_sphere=final_le_sphere)
+    except (sqlite3.Error, ValueError) as e:
+        st.error(f"Could not save the plan: {e}")
+    else:
+        st.success(f"Plan {plan_id} saved for patient {plan_patient}")
+if plan_patient:
+    saved_plans = open_plan_store().find_plans(patient_id=plan_patient, limit=10)
+    if saved_plans:
+        st.caption("Saved plans for this patient (newest first)")
+        st.dataframe(saved_plans)
+
+with st.expander("📈 Binocular Acuity Curve"):
+    st.caption("Monocular defocus curves from each eye's bars, combined by probability summation. Lower logMAR is better.")
+    acuity_threshold = st.slider("Acuity threshold (logMAR)", 0.0, 0.5, 0.2, 0.1, key="acuity_threshold")
+    re_bars = zoom_engine.bar_endpoints(re_q, bia, re_refraction, re_mono, re_se_dof, re_q_factor)
+    le_bars = zoom_engine.bar_endpoints(le_q, bia, le_refraction, le_mono, le_se_dof, le_q_factor)
+    re_logmar = zoom_engine.monocular_acuity(re_bars[3], re_bars[5])
+    le_logmar = zoom_engine.monocular_acuity(le_bars[3], le_bars[5])
+    bino_logmar = zoom_engine.binocular_summation(re_logmar, le_logmar)
+    bino_width, bino_first, bino_last = zoom_engine.binocular_range(bino_logmar, acuity_threshold)
+    if bino_width > 0:
+        st.write(f"**Binocular range at logMAR ≤ {acuity_threshold:.1f}:** {bino_width:.2f} D ({bino_first:.2f} D to {bino_last:.2f} D)")
+    else:
+        st.write(f"**Binocular range at logMAR ≤ {acuity_threshold:.1f}:** none")
+    ac_fig, ac_ax = plt.subplots(figsize=(10, 3))
+    ac_ax.plot(zoom_engine.defocus_grid, re_logmar, color='darkred', lw=1, label="Right Eye")
+    ac_ax.plot(zoom_engine.defocus_grid, le_logmar, color='navy', lw=1, label="Left Eye")
+    ac_ax.plot(zoom_engine.defocus_grid, bino_logmar, color='black', lw=2, label="Binocular")
+    ac_ax.axhline(acuity_threshold, color='gray', linestyle=':')
+    ac_ax.axvline(-2.5, color='purple', linestyle='--', lw=1.5)
+    ac_ax.set_xlim(-5, 2)
+    ac_ax.set_ylim(1.0, -0.2)
+    ac_ax.set_xlabel("Vergence (D)")
+    ac_ax.set_ylabel("logMAR")
+    ac_ax.legend()
+    st.pyplot(ac_fig)
+    plt.close(ac_fig)
+
+with st.expander("🔬 Through-Focus Visual Strehl"):
+    st.caption("Visual Strehl ratio (CSF-weighted MTF, 3 mm pupil) across object vergence from a pupil model with defocus and spherical aberration (preop SA minus Q-induced SA).")
+    if st.toggle("Compute through-focus curves", key="show_through_focus"):
+        tf_fig, tf_ax = plt.subplots(figsize=(10, 3))
+        tf_ax.plot(zoom_optics.vergences, zoom_optics.through_focus(sa_re, re_q, re_refraction + re_mono), color='darkred', label="Right Eye")
+        tf_ax.plot(zoom_optics.vergences, zoom_optics.through_focus(sa_le, le_q, le_refraction + le_mono), color='navy', label="Left Eye")
+        tf_ax.axvline(-2.5, color='purple', linestyle='--', lw=1.5)
+        tf_ax.set_xlim(-5, 2)
+        tf_ax.set_xlabel("Object Vergence (D)")
+        tf_ax.set_ylabel("Visual Strehl")
+        tf_ax.legend()
+        st.pyplot(tf_fig)
+        plt.close(tf_fig)
+
+with st.expander("👁️ Simulated Retinal Images"):
+    st.caption("Tumbling-E chart (20/60 to 20/20) as imaged by each eye at distance, intermediate and near, from that eye's PSF (3 mm pupil).")
+    if st.toggle("Render retinal images", key="show_retinal_images"):
+        ret_fig, ret_axs = plt.subplots(2, 3, figsize=(9, 6))
+        for row, (eye_label, eye_sa, eye_q, eye_shift) in enumerate([("RE", sa_re, re_q, re_refraction + re_mono), ("LE", sa_le, le_q, le_refraction + le_mono)]):
+            for col, vergence in enumerate([0.0, -1.25, -2.5]):
+                ret_axs[row, col].imshow(zoom_optics.retinal_image(eye_sa, eye_q, eye_shift, vergence), cmap='gray', vmin=0, vmax=1)
+                ret_axs[row, col].set_title(f"{eye_label} at {vergence:.2f} D", fontsize=10)
+                ret_axs[row, col].axis('off')
+        plt.tight_layout()
+        st.pyplot(ret_fig)
+        plt.close(ret_fig)
+
+with st.expander("🎲 Outcome Uncertainty (Monte Carlo)"):
+    st.caption("1,000,000 simulated outcomes of this plan with scatter in preop SA, pupil (2–6 mm), achieved sphere and achieved ΔQ.")
+    if st.toggle("Run 1,000,000-sample simulation", key="show_monte_carlo"):
+        mc = monte_carlo_plan(se_re, se_le, sa_re, sa_le, bia, re_q, le_q, re_refraction + re_mono, le_refraction + le_mono, seed=0,
+                               re_q_dof_factor=re_q_factor, le_q_dof_factor=le_q_factor, coefficients=dof_coefficients)
+        st.write(f"**Probability of Poor Binocular Fusion (<0.75D):** {mc['p_poor_fusion']:.1%}")
+        st.write(f"**Probability of No Binocular Overlap:** {mc['p_no_overlap']:.1%}")
+        st.write(f"**Overlap (5th / 50th / 95th percentile):** {mc['percentiles'][5]:.2f} / {mc['percentiles'][50]:.2f} / {mc['percentiles'][95]:.2f} D")
+        mc_fig, mc_ax = plt.subplots(figsize=(8, 3))
+        mc_ax.bar(mc['bin_edges'][:-1], mc['counts'] / mc['n_samples'], width=np.diff(mc['bin_edges']), align='edge', color='cyan', edgecolor='blue')
+        mc_ax.axvline(0.75, color='red', linestyle='--', lw=1.5)
+        mc_ax.set_xlabel("Binocular Overlap (D)")
+        mc_ax.set_ylabel("Fraction of outcomes")
+        st.pyplot(mc_fig)
+        plt.close(mc_fig)
+
+with st.expander("💡 Suggested Plans"):
+    st.caption("Top slider combinations for this patient, ranked against the 1.0–1.5 D overlap target and the 2.5 D near line. Lower score is better.")
+    if st.toggle("Search plans", key="show_suggested_plans"):
+        st.table(suggest_plans(re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, bia,
+                               re_q_dof_factor=re_q_factor, le_q_dof_factor=le_q_factor, coefficients=dof_coefficients))
+
+with st.expander("🛡️ Robust Plans (±0.5 D scatter)"):
+    st.caption("Plans scored against every combination of ±0.5 D achieved sphere and ±20% achieved ΔQ in each eye. Higher value is better.")
+    if st.toggle("Search robust plans", key="show_robust_plans"):
+        robust_objective = st.radio("Objective", ["worst", "expected"], horizontal=True, key="robust_objective")
+        st.table(robust_plans(re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, bia, objective=robust_objective,
+                              re_q_dof_factor=re_q_factor, le_q_dof_factor=le_q_factor, coefficients=dof_coefficients))
+
+with st.expander("🗺️ Valid Refraction Add Region"):
+    st.caption("Shaded: every RE/LE refraction add giving 1.0–1.5 D binocular overlap and reaching the near line, for the current ΔQ, BIA and monovision.")
+    if st.toggle("Compute region", key="show_valid_region"):
+        region_fig, region_ax = plt.subplots(figsize=(5, 5))
+        for poly in feasible_region(re_q, le_q, bia, re_se_dof, le_se_dof, re_mono, le_mono,
+                                    re_q_dof_factor=re_q_factor, le_q_dof_factor=le_q_factor, coefficients=dof_coefficients):
+            region_ax.fill(poly[:, 0], poly[:, 1], color='cyan', alpha=0.5, lw=0)
+        region_ax.plot(re_refraction, le_refraction, 'ro')
+        region_ax.set_xlim(0, 6)
+        region_ax.set_ylim(0, 6)
+        region_ax.set_xlabel("Right Eye Refraction Add (D)")
+        region_ax.set_ylabel("Left Eye Refraction Add (D)")
+        region_ax.grid(True, alpha=0.3)
+        st.pyplot(region_fig)
+        plt.close(region_fig)
+
 
 st.markdown('''
 ### 📝 Instructions for Using the Presbyopic LASIK Simulator
@@ -0,0 +1,115 @@
+import numpy as np
+
+# Ablation profiles: exact Munnerlyn (difference of pre- and post-op conic surfaces) with the
+# post-op asphericity target, on a float32 polar grid, vectorized over a list of plans.
+n_keratometric = 1.3375  # K readings <-> radius
+n_cornea = 1.376         # refractive index of the ablated stroma
+optic_zone_mm = 6.0
+total_zone_mm = 9.0     # optic zone + transition zone
+n_radii = 64
+n_meridians = 36
+
+
+def k_to_radius(k):
+    return (n_keratometric - 1) * 1000 / k
+
+
+def _conic_sag(r, R, Q):
+    return r**2 / (R * (1 + np.sqrt(np.maximum(1 - (1 + Q) * r**2 / R**2, 0))))
+
+
+# Polar grid out to the total ablation zone: radii (mm) and meridians (rad), float32
+def polar_grid(total_zone=total_zone_mm, n_r=n_radii, n_theta=n_meridians):
+    r = np.linspace(0, total_zone / 2, n_r, dtype=np.float32)
+    theta = np.linspace(0, np.pi, n_theta, endpoint=False, dtype=np.float32)
+    return r, theta
+
+
+# Ablation depth (µm) for each plan on the polar grid, shape (plans, meridians, radii).
+# correction is the sphere programmed into the laser (D, + for hyperopia); cyl/axis (degrees) add
+# meridional power S + C sin^2(theta - axis). The post-op surface in each meridian is a conic with the
+# steepened/flattened radius and Q = q_pre - q_delta. Inside the optic zone the depth is the
+# difference of the two surfaces (zero at its shallowest point); across the transition zone it
+# tapers to zero with a raised cosine.
+def ablation_profile(correction, k_pre=43.5, q_pre=-0.2, q_delta=0.0, cyl=0.0, axis=0.0,
+                     oz=optic_zone_mm, total_zone=total_zone_mm, n_r=n_radii, n_theta=n_meridians):
+    correction, k_pre, q_pre, q_delta, cyl, axis = (
+        np.atleast_1d(np.asarray(a, dtype=np.float32))[:, np.newaxis, np.newaxis]
+        for a in np.broadcast_arrays(correction, k_pre, q_pre, q_delta, cyl, axis)
+    )
+    r, theta = polar_grid(total_zone, n_r, n_theta)
+    r = r[np.newaxis, np.newaxis, :]
+    meridian_power = correction + cyl * np.sin(theta[np.newaxis, :, np.newaxis] - np.deg2rad(axis))**2
+
+    R_pre = k_to_radius(k_pre)
+    R_post = (n_cornea - 1) * 1000 / ((n_cornea - 1) * 1000 / R_pre + meridian_power)
+    q_post = q_pre - q_delta
+    r_oz = np.minimum(r, np.float32(oz / 2))
+    diff = (_conic_sag(r_oz, R_post, q_post) - _conic_sag(r_oz, R_pre, q_pre)) * 1000
+    depth = diff - diff.min(axis=(-2, -1), keepdims=True)
+
+    # Raised-cosine taper of the OZ-edge depth across the transition zone
+    t = np.clip((r - oz / 2) / max((total_zone - oz) / 2, 1e-6), 0, 1)
+    taper = np.float32(0.5) * (1 + np.cos(np.pi * t))
+    depth = np.where(r <= oz / 2, depth, depth * taper)
+    return depth.astype(np.float32), r[0, 0], theta
+
+
+# Tissue cost of each plan: max depth, max depth within the transition zone (µm), central depth
+# (µm) and ablation volume (mm^3)
+def ablation_summary(correction, k_pre=43.5, q_pre=-0.2, q_delta=0.0, cyl=0.0, axis=0.0,
+                     oz=optic_zone_mm, total_zone=total_zone_mm, n_r=n_radii, n_theta=n_meridians):
+    depth, r, theta = ablation_profile(correction, k_pre, q_pre, q_delta, cyl, axis, oz, total_zone, n_r, n_theta)
+    in_tz = r > oz / 2
+    dr = r[1] - r[0]
+    dtheta = np.float32(np.pi) / len(theta)
+    # Meridians cover 0..pi; each also stands for its opposite half-meridian
+    volume = 2 * (depth * r).sum(axis=(-2, -1)) * dr * dtheta / 1000
+    return {
+        "max_depth": depth.max(axis=(-2, -1)),
+        "tz_depth": depth[..., in_tz].max(axis=(-2, -1)) if in_tz.any() else np.zeros(len(depth), dtype=np.float32),
+        "central_depth": depth[..., 0].max(axis=-1),
+        "volume": volume,
+    }
+
+
+# Default tissue-safety limits (override any of them per call)
+safety_limits = {
+    "max_postop_k": 49.0,   # D, hyperopic steepening
+    "min_postop_k": 35.0,   # D, myopic flattening
+    "max_pta": 0.40,        # percent tissue altered, as a fraction
+    "min_rsb": 300.0,       # µm residual stromal bed
+}
+
+
+# Predict postop K, percent tissue altered and residual stromal bed for every plan in one pass
+# and flag plans outside the limits. Ablation depth (µm) is computed from the plans when not given.
+def screen_plans(final_sphere, k_pre, pachymetry, flap=110.0, ablation_depth=None, q_pre=-0.2, q_delta=0.0,
+                 cyl=0.0, axis=0.0, k_change_per_d=1.0, limits=None):
+    limits = {**safety_limits, **(limits or {})}
+    final_sphere = np.asarray(final_sphere, dtype=np.float64)
+    k_pre = np.asarray(k_pre, dtype=np.float64)
+    pachymetry = np.asarray(pachymetry, dtype=np.float64)
+    if ablation_depth is None:
+        ablation_depth = ablation_summary(final_sphere, k_pre, q_pre, q_delta, cyl, axis)["max_depth"]
+        ablation_depth = ablation_depth.reshape(np.broadcast(final_sphere, k_pre).shape)
+    ablation_depth = np.asarray(ablation_depth, dtype=np.float64)
+
+    # Spherical-equivalent change in corneal power
+    postop_k = k_pre + k_change_per_d * (final_sphere + np.asarray(cyl) / 2)
+    pta = (flap + ablation_depth) / pachymetry
+    rsb = pachymetry - flap - ablation_depth
+
+    k_flag = (postop_k > limits["max_postop_k"]) | (postop_k < limits["min_postop_k"])
+    pta_flag = pta > limits["max_pta"]
+    rsb_flag = rsb < limits["min_rsb"]
+    return {
+        "postop_k": postop_k,
+        "pta": pta,
+        "rsb": rsb,
+        "ablation_depth": ablation_depth,
+        "k_flag": k_flag,
+        "pta_flag": pta_flag,
+        "rsb_flag": rsb_flag,
+        "unsafe": k_flag | pta_flag | rsb_flag,
+    }
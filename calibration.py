@@ -0,0 +1,415 @@
+"""Calibration workbench for the empirical DOF coefficients.
+
+Refits the constants behind get_dof_from_se, q_to_dof and get_dof_myopia against an outcomes
+dataset (CSV, or the Parquet store of outcomes_store.py) with k-fold cross-validation (folds run in a process pool) and writes a versioned
+coefficient set that the simulators load on every run. Bootstrap refits for the simulators' DOF
+confidence bands are stored next to the version (--bootstrap N, 0 to skip), so the apps only read them.
+
+    python calibration.py outcomes.csv --folds 5 --workers 4 --bootstrap 200
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import numpy as np
+
+import zoom_engine
+
+coefficients_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coefficients")
+
+# The literals the simulators shipped with (owned by zoom_engine); used when no calibrated set exists
+default_coefficients = zoom_engine.default_coefficients
+
+sa_k_grid = np.arange(0.0, 3.0 + 1e-9, 0.01)
+# Smallest spread of log(pupil_ref / pupil) over which the pupil exponent is fitted
+pupil_spread = 1e-6
+# Pupil (mm) assumed for outcomes without one, as in the simulators
+default_pupil = 3.0
+induction_grid = np.arange(0.010, 0.100 + 1e-9, 0.001)
+sa_cap_grid = np.arange(0.30, 1.00 + 1e-9, 0.01)
+
+
+# ---- Models (unrounded, as fitted) ----
+
+def predict_se_dof(c, se, sa_preop, pupil):
+    return c["se_slope"] * se * (c["pupil_ref"] / pupil)**c["pupil_exponent"] * (1 - c["sa_k"] * sa_preop)
+
+
+def predict_q_dof(c, q_delta):
+    return c["q_to_dof"] * q_delta
+
+
+def predict_myopic_dof(c, sphere, cyl, sa_preop):
+    total_myopia = np.abs(sphere) + np.abs(cyl)
+    return c["myopia_dof_per_sa"] * np.minimum(sa_preop + c["myopia_induction"] * total_myopia, c["myopia_sa_cap"])
+
+
+# ---- Fits ----
+
+# dof = slope * se * (pupil_ref / pupil)^exponent * (1 - k * sa). For every k on a grid,
+# log(dof / (se (1 - k sa))) is linear in (log slope, exponent); pupil_ref stays fixed because
+# only slope * pupil_ref^exponent is identifiable. When every outcome has the same pupil the
+# exponent is not identifiable either, so it keeps pupil_exponent and only the slope is fitted.
+def fit_se_dof(se, sa_preop, pupil, dof, pupil_ref=default_coefficients["pupil_ref"],
+               pupil_exponent=default_coefficients["pupil_exponent"]):
+    se, sa_preop, pupil, dof = (np.asarray(a, dtype=np.float64) for a in (se, sa_preop, pupil, dof))
+    use = (se > 0) & (dof > 0)
+    se, sa_preop, pupil, dof = se[use], sa_preop[use], pupil[use], dof[use]
+
+    k = sa_k_grid[:, np.newaxis]
+    factor = 1 - k * sa_preop
+    ok = factor > 0
+    y = np.log(np.where(ok, dof / (se * np.where(ok, factor, 1.0)), 1.0))
+    x = np.log(pupil_ref / pupil)
+    w = ok.astype(np.float64)
+    n, sx, sy = w.sum(axis=1), (w * x).sum(axis=1), (w * y).sum(axis=1)
+    sxx, sxy = (w * x * x).sum(axis=1), (w * x * y).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if len(x) and np.ptp(x) > pupil_spread:
+            exponent = (n * sxy - sx * sy) / (n * sxx - sx**2)
+        else:
+            exponent = np.full(len(n), float(pupil_exponent))
+        log_slope = (sy - exponent * sx) / n
+    slope = np.exp(log_slope)
+
+    pred = slope[:, np.newaxis] * se * (pupil_ref / pupil)**exponent[:, np.newaxis] * factor
+    sse = ((pred - dof)**2).sum(axis=1)
+    sse = np.where(np.isfinite(sse) & (n == len(dof)), sse, np.inf)
+    best = int(np.argmin(sse))
+    return {"se_slope": float(slope[best]), "pupil_ref": pupil_ref, "pupil_exponent": float(exponent[best]),
+            "sa_k": round(float(sa_k_grid[best]), 2)}
+
+
+# Least-squares slope through the origin; no fit (empty dict) when every q_delta is zero
+def fit_q_dof(q_delta, q_dof):
+    q_delta, q_dof = np.asarray(q_delta, dtype=np.float64), np.asarray(q_dof, dtype=np.float64)
+    sxx = (q_delta**2).sum()
+    if sxx == 0:
+        return {}
+    return {"q_to_dof": float((q_delta * q_dof).sum() / sxx)}
+
+
+# dof = c * min(sa + induction * T, cap): grid over (induction, cap), c in closed form
+def fit_myopic_dof(sphere, cyl, sa_preop, dof):
+    sphere, cyl, sa_preop, dof = (np.asarray(a, dtype=np.float64) for a in (sphere, cyl, sa_preop, dof))
+    total_myopia = np.abs(sphere) + np.abs(cyl)
+    best = (np.inf, None)
+    for cap in sa_cap_grid:
+        x = np.minimum(sa_preop + induction_grid[:, np.newaxis] * total_myopia, cap)
+        c = (x * dof).sum(axis=1) / (x * x).sum(axis=1)
+        sse = ((c[:, np.newaxis] * x - dof)**2).sum(axis=1)
+        i = int(np.argmin(sse))
+        if sse[i] < best[0]:
+            best = (sse[i], {"myopia_induction": round(float(induction_grid[i]), 3), "myopia_sa_cap": round(float(cap), 2),
+                             "myopia_dof_per_sa": float(c[i])})
+    return best[1]
+
+
+# ---- Dataset and cross-validation ----
+
+hyperopic_columns = ["se", "sa_preop", "pupil", "dof"]
+q_columns = ["q_delta", "q_dof"]
+myopic_columns = ["sphere", "cyl", "sa_preop", "dof"]
+
+
+# Rows of a dataset (dict of column arrays) that have every listed column. A missing pupil
+# (column or value) is taken as default_pupil.
+def _complete(data, columns, model=None):
+    if "pupil" in columns:
+        n = len(next(iter(data.values())))
+        pupil = np.asarray(data["pupil"], dtype=np.float64) if "pupil" in data else np.full(n, np.nan)
+        data = {**data, "pupil": np.where(np.isnan(pupil), default_pupil, pupil)}
+    mask = np.ones(len(next(iter(data.values()))), dtype=bool)
+    if model is not None and "model" in data:
+        mask &= np.asarray(data["model"]) == model
+    for name in columns:
+        if name not in data:
+            return {name: np.zeros(0) for name in columns}
+        mask &= ~np.isnan(np.asarray(data[name], dtype=np.float64))
+    return {name: np.asarray(data[name], dtype=np.float64)[mask] for name in columns}
+
+
+# Fit every coefficient group that has data. A group without data, or whose fit is not finite,
+# keeps its value in base (the latest published set, typically; default_coefficients when None).
+def fit_all(data, base=None):
+    coeffs = dict(base or default_coefficients)
+    fits = []
+    hyper = _complete(data, hyperopic_columns, "hyperopic")
+    if len(hyper["dof"]) >= 3:
+        fits.append(fit_se_dof(**hyper, pupil_ref=coeffs["pupil_ref"], pupil_exponent=coeffs["pupil_exponent"]))
+    q = _complete(data, q_columns, "hyperopic")
+    if len(q["q_dof"]):
+        fits.append(fit_q_dof(**q))
+    myo = _complete(data, myopic_columns, "myopic")
+    if len(myo["dof"]) >= 3:
+        fits.append(fit_myopic_dof(**myo))
+    for fit in fits:
+        if all(np.isfinite(value) for value in fit.values()):
+            coeffs.update(fit)
+    return coeffs
+
+
+def _rmse(pred, obs):
+    return float(np.sqrt(np.mean((pred - obs)**2))) if len(obs) else float("nan")
+
+
+# Held-out RMSE of each model for one fold (runs in a worker process)
+def _run_fold(args):
+    data, train, test, base = args
+    coeffs = fit_all({name: np.asarray(col)[train] for name, col in data.items()}, base)
+    held = {name: np.asarray(col)[test] for name, col in data.items()}
+    hyper = _complete(held, hyperopic_columns, "hyperopic")
+    q = _complete(held, q_columns, "hyperopic")
+    myo = _complete(held, myopic_columns, "myopic")
+    return {
+        "se_dof": _rmse(predict_se_dof(coeffs, hyper["se"], hyper["sa_preop"], hyper["pupil"]), hyper["dof"]),
+        "q_dof": _rmse(predict_q_dof(coeffs, q["q_delta"]), q["q_dof"]),
+        "myopic_dof": _rmse(predict_myopic_dof(coeffs, myo["sphere"], myo["cyl"], myo["sa_preop"]), myo["dof"]),
+    }
+
+
+# k-fold cross-validation with the folds spread over a process pool, then a fit on all data
+def cross_validate(data, folds=5, workers=None, seed=0, base=None):
+    n = len(next(iter(data.values())))
+    order = np.random.default_rng(seed).permutation(n)
+    splits = np.array_split(order, folds)
+    jobs = [(data, np.concatenate(splits[:i] + splits[i + 1:]), splits[i], base) for i in range(folds)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        fold_scores = list(pool.map(_run_fold, jobs))
+    # Models with no rows in the data have no score (None)
+    cv = {}
+    for name in fold_scores[0]:
+        scores = [s[name] for s in fold_scores if not np.isnan(s[name])]
+        cv[name] = float(np.mean(scores)) if scores else None
+    return fit_all(data, base), cv, fold_scores
+
+
+# Columns kept as text even when every value looks numeric
+text_columns = ("model", "surgeon", "date", "patient_id", "eye")
+# Columns the fits read; queries against the Parquet store fetch only these
+model_columns = ["model", *dict.fromkeys(hyperopic_columns + q_columns + myopic_columns)]
+
+
+# Outcomes CSV -> dict of columns (numeric where possible, blanks as NaN)
+def load_outcomes_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    data = {}
+    for name in rows[0] if rows else []:
+        values = [row[name] for row in rows]
+        try:
+            if name in text_columns:
+                raise ValueError
+            data[name] = np.array([float(v) if v.strip() else np.nan for v in values])
+        except ValueError:
+            data[name] = np.array(values)
+    return data
+
+
+# Outcomes from a CSV file or a Parquet store directory (see outcomes_store), optionally filtered by
+# surgeon, model variant and date range (since inclusive, until exclusive)
+def load_outcomes(path, surgeon=None, model=None, since=None, until=None, columns=model_columns):
+    if os.path.isdir(path):
+        import outcomes_store
+        available = outcomes_store.open_outcomes(path).schema.names
+        return outcomes_store.query_outcomes(path, [name for name in columns if name in available], surgeon, model, since, until)
+
+    data = load_outcomes_csv(path)
+    n = len(next(iter(data.values()), []))
+    mask = np.ones(n, dtype=bool)
+    for column, value in (("surgeon", surgeon), ("model", model)):
+        if value is not None:
+            mask &= np.isin(data[column], [value] if isinstance(value, str) else list(value))
+    if since is not None:
+        mask &= data["date"].astype("datetime64[D]") >= np.datetime64(str(since), "D")
+    if until is not None:
+        mask &= data["date"].astype("datetime64[D]") < np.datetime64(str(until), "D")
+    return {name: data[name][mask] for name in columns if name in data}
+
+
+# ---- Bootstrap confidence intervals ----
+
+# Refit on a batch of resamples (runs in a worker process); returns (resamples, coefficients)
+def _bootstrap_batch(args):
+    data, seed, n_resamples, base = args
+    rng = np.random.default_rng(seed)
+    n = len(next(iter(data.values())))
+    out = np.empty((n_resamples, len(default_coefficients)))
+    for b in range(n_resamples):
+        pick = rng.integers(0, n, n)
+        coeffs = fit_all({name: np.asarray(col)[pick] for name, col in data.items()}, base)
+        out[b] = [coeffs[name] for name in default_coefficients]
+    return out
+
+
+# Coefficients refitted on n_boot resamples of the outcomes, spread over a process pool, as
+# {name: array of n_boot values}
+def bootstrap_coefficients(data, n_boot=200, workers=None, seed=0, batch_size=25, base=None):
+    batches = [(data, seed + i, min(batch_size, n_boot - start), base) for i, start in enumerate(range(0, n_boot, batch_size))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        samples = np.concatenate(list(pool.map(_bootstrap_batch, batches)))
+    return {name: samples[:, i] for i, name in enumerate(default_coefficients)}
+
+
+# The resamples are fitted offline (main --bootstrap) and stored next to the coefficient version
+# they belong to, so the apps only read them
+def _bootstrap_file(directory, version):
+    return os.path.join(directory, f"dof_coefficients_v{version:04d}.boot.npz")
+
+
+def save_bootstrap(samples, version, directory=coefficients_dir):
+    path = _bootstrap_file(directory, version)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **{name: np.asarray(samples[name], dtype=np.float64) for name in default_coefficients})
+    os.replace(tmp, path)
+    return path
+
+
+# Bootstrap samples file of a coefficient version, or None when that version has none
+def bootstrap_path(version, directory=coefficients_dir):
+    path = _bootstrap_file(directory, version) if version else None
+    return path if path and os.path.exists(path) else None
+
+
+@lru_cache(maxsize=4)
+def _read_bootstrap(path, mtime):
+    with np.load(path) as f:
+        return {name: f[name] for name in default_coefficients}
+
+
+# Inputs are quantized to the simulators' input steps, so repeated reruns hit the cache
+@lru_cache(maxsize=4096)
+def _dof_interval(path, mtime, model, a, b, sa_preop, pupil, level):
+    boot = _read_bootstrap(path, mtime)
+    if model == "myopic":
+        dof = predict_myopic_dof(boot, a, b, sa_preop)
+    elif isinstance(pupil, str):
+        # Expected DOF over a pupil-size profile
+        sizes, weights = zoom_engine.pupil_weight_table(pupil)
+        boot = {name: values[:, np.newaxis] for name, values in boot.items()}
+        dof = np.maximum(predict_se_dof(boot, a, sa_preop, sizes), 0) @ weights
+    else:
+        dof = np.maximum(predict_se_dof(boot, a, sa_preop, pupil), 0)
+    dof = np.where(a == 0 and model != "myopic", 0.0, dof)
+    tail = (1 - level) / 2 * 100
+    low, high = np.percentile(dof, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+# Bootstrap interval (D) of the predicted, unrounded DOF for one eye from the samples at path
+# (bootstrap_path): hyperopic takes the SE and a pupil diameter or pupil-profile name, myopic the
+# sphere and cylinder
+def dof_interval(path, sa_preop, se=0.0, pupil=3.0, sphere=0.0, cyl=0.0, model="hyperopic", level=0.95):
+    if model == "myopic":
+        a, b = round(sphere * 4) / 4, round(cyl * 4) / 4
+    else:
+        a, b = round(se * 8) / 8, 0.0
+    if not isinstance(pupil, str):
+        pupil = round(pupil * 4) / 4
+    return _dof_interval(path, os.path.getmtime(path), model, a, b, round(sa_preop, 2), pupil, level)
+
+
+# ---- Versioned coefficient sets ----
+
+# Version number of a coefficient file path (None for other paths)
+def path_version(path):
+    match = re.search(r"_v(\d+)\.json$", path)
+    return int(match.group(1)) if match else None
+
+
+def _versions(directory):
+    found = []
+    for path in glob.glob(os.path.join(directory, "dof_coefficients_v*.json")):
+        version = path_version(path)
+        if version is not None:
+            found.append((version, path))
+    return sorted(found)
+
+
+def save_coefficients(coeffs, directory=coefficients_dir, **metadata):
+    bad = [name for name in default_coefficients if not np.isfinite(coeffs[name])]
+    if bad:
+        raise ValueError(f"refusing to save non-finite coefficients: {', '.join(bad)}")
+    os.makedirs(directory, exist_ok=True)
+    versions = _versions(directory)
+    version = versions[-1][0] + 1 if versions else 1
+    path = os.path.join(directory, f"dof_coefficients_v{version:04d}.json")
+    record = {
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "coefficients": {name: float(coeffs[name]) for name in default_coefficients},
+        **metadata,
+    }
+    # Write then rename, so running apps never read a half-written file
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+@lru_cache(maxsize=8)
+def _read_coefficients(path, mtime):
+    with open(path, encoding="utf-8") as f:
+        record = json.load(f)
+    # Non-finite values (from sets written before save_coefficients checked) fall back to the defaults
+    coeffs = {name: value for name, value in record["coefficients"].items() if np.isfinite(value)}
+    return {**default_coefficients, **coeffs}, record["version"]
+
+
+# Latest coefficient set (defaults when none has been written). Only the directory listing is
+# read on each call, so a newly published version is picked up by the next app rerun.
+def load_coefficients(directory=coefficients_dir, with_version=False):
+    versions = _versions(directory)
+    if not versions:
+        coeffs, version = dict(default_coefficients), 0
+    else:
+        path = versions[-1][1]
+        coeffs, version = _read_coefficients(path, os.path.getmtime(path))
+        coeffs = dict(coeffs)
+    return (coeffs, version) if with_version else coeffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refit the ZOOM DOF coefficients")
+    parser.add_argument("outcomes", help="outcomes CSV or Parquet store directory")
+    parser.add_argument("--surgeon", help="only this surgeon's outcomes")
+    parser.add_argument("--model", choices=["hyperopic", "myopic"], help="only this model variant")
+    parser.add_argument("--since", help="first surgery date, YYYY-MM-DD")
+    parser.add_argument("--until", help="end surgery date (exclusive), YYYY-MM-DD")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="processes for the folds (default: CPU count)")
+    parser.add_argument("--out", default=coefficients_dir, help="coefficient directory")
+    parser.add_argument("--bootstrap", type=int, default=200, metavar="N",
+                        help="resamples stored with the new version for the apps' DOF confidence bands (0: none)")
+    parser.add_argument("--dry-run", action="store_true", help="report without writing a new version")
+    args = parser.parse_args(argv)
+
+    data = load_outcomes(args.outcomes, args.surgeon, args.model, args.since, args.until)
+    # Groups without data (e.g. the other model under --model) keep the latest published values
+    base, base_version = load_coefficients(args.out, with_version=True)
+    coeffs, cv, _ = cross_validate(data, args.folds, args.workers, base=base)
+    for name in default_coefficients:
+        print(f"{name:>20}: {base[name]:.4f} -> {coeffs[name]:.4f}")
+    for name, rmse in cv.items():
+        print(f"{'CV RMSE ' + name:>20}: " + (f"{rmse:.4f} D" if rmse is not None else "no data"))
+    if not args.dry_run:
+        path = save_coefficients(coeffs, args.out, source=os.path.abspath(args.outcomes), folds=args.folds, cv_rmse=cv,
+                                 bootstrap=args.bootstrap, base_version=base_version,
+                                 filters={k: v for k, v in (("surgeon", args.surgeon), ("model", args.model),
+                                                            ("since", args.since), ("until", args.until)) if v})
+        print(f"Wrote {path}")
+        if args.bootstrap > 0:
+            version = path_version(path)
+            samples = bootstrap_coefficients(data, args.bootstrap, args.workers, base=base)
+            print(f"Wrote {save_bootstrap(samples, version, args.out)}")
+
+
+if __name__ == "__main__":
+    main()
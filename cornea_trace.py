@@ -0,0 +1,72 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Single-surface conic cornea: parallel ray fans refracted by the anterior surface into a
+# keratometric-index eye, giving longitudinal spherical aberration across the optic zone.
+n_air = 1.0
+n_eye = 1.3375          # keratometric index
+optic_zone_mm = 6.0
+n_rays = 61
+
+
+# Sag (mm) of a conic surface with apical radius R and asphericity Q at ray height h
+def conic_sag(h, R, Q):
+    h = np.asarray(h, dtype=np.float64)
+    return h**2 / (R * (1 + np.sqrt(1 - (1 + Q) * h**2 / R**2)))
+
+
+# Trace ray fans (heights h, mm) parallel to the axis through conic surfaces.
+# R and Q broadcast against h, so many corneas are traced at once.
+# Returns the axial crossing point (mm from the vertex) of each refracted ray.
+def trace_axial_focus(h, R, Q):
+    h = np.asarray(h, dtype=np.float64)
+    R = np.asarray(R, dtype=np.float64)
+    Q = np.asarray(Q, dtype=np.float64)
+    z = conic_sag(h, R, Q)
+    slope = h / (R * np.sqrt(1 - (1 + Q) * h**2 / R**2))
+
+    # Unit surface normal pointing back towards the incoming ray, in (r, z)
+    norm = np.sqrt(1 + slope**2)
+    nr, nz = slope / norm, -1 / norm
+    # Incoming direction is +z; vector Snell's law
+    eta = n_air / n_eye
+    cos_i = -nz
+    cos_t = np.sqrt(1 - eta**2 * (1 - cos_i**2))
+    tr = (eta * cos_i - cos_t) * nr
+    tz = eta + (eta * cos_i - cos_t) * nz
+    return z - h * tz / tr
+
+
+# Dioptric longitudinal spherical aberration of each ray relative to the paraxial focus
+def lsa_diopters(h, R, Q):
+    focus = trace_axial_focus(h, R, Q)
+    paraxial = n_eye * np.asarray(R, dtype=np.float64) / (n_eye - n_air)
+    return n_eye * 1000 / focus - n_eye * 1000 / paraxial
+
+
+# Ray heights of one fan across the optic zone (the axial ray itself is excluded)
+def ray_fan(zone=optic_zone_mm, n=n_rays):
+    return np.linspace(0, zone / 2, n + 1)[1:]
+
+
+# LSA (D) at the optic-zone edge and the implied DOF (dioptric spread of ray foci) of one cornea.
+# R is rounded to 0.01 mm and Q to 0.001 so slider moves hit the cache.
+@lru_cache(maxsize=4096)
+def _traced(R_q, Q_q, zone):
+    lsa = lsa_diopters(ray_fan(zone), R_q / 100, Q_q / 1000)
+    return float(lsa[-1]), float(lsa.max() - lsa.min())
+
+
+def traced_lsa_dof(R, Q, zone=optic_zone_mm):
+    return _traced(int(round(R * 100)), int(round(Q * 1000)), zone)
+
+
+# Traced replacement for q_to_dof: shift of the optic-zone edge focus (D) per unit of Q made
+# more negative by q_delta, starting from the baseline Q (a zero q_delta uses one slider step)
+def traced_q_to_dof(R, Q, q_delta, zone=optic_zone_mm):
+    if q_delta == 0:
+        q_delta = 0.06
+    lsa_before, _ = traced_lsa_dof(R, Q, zone)
+    lsa_after, _ = traced_lsa_dof(R, Q - q_delta, zone)
+    return (lsa_before - lsa_after) / q_delta
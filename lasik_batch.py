@@ -0,0 +1,174 @@
+"""Headless batch runner for the presbyopic LASIK calculator (lasik_calculator.py).
+
+Reads CSV or JSONL rows with re_od, re_os, monovision_tolerance and extra_add,
+evaluates them chunk by chunk and streams the results out, so memory stays
+constant however large the input file is. Rows with a missing, blank or
+non-numeric input are skipped and reported by input line number on stderr, and
+the exit status is 1 when any row was skipped.
+
+    python lasik_batch.py patients.csv results.csv --chunk-size 100000
+    python lasik_batch.py patients.jsonl - --format jsonl
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+
+import numpy as np
+
+# Constants (same as lasik_calculator.py)
+q_per_d = 0.3 / 1.25
+
+input_fields = ["re_od", "re_os", "monovision_tolerance", "extra_add"]
+result_fields = ["re_final_refraction", "re_q_change", "le_final_refraction", "le_q_change"]
+# Skipped rows reported one by one on stderr; any further ones are only counted
+max_reported_errors = 20
+
+
+# Python's round(x, 2), as the calculator uses, vectorized. It rounds the exact binary value,
+# which np.round (scale by 100, round, divide) does not near half-cent ties, e.g. 2.675 -> 2.67.
+# Only values within float noise of a tie go through the scalar round.
+def _round2(a):
+    a = np.asarray(a, dtype=np.float64)
+    out = np.round(a, 2)
+    scaled = a * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        out[near_tie] = [round(float(v), 2) for v in a[near_tie]]
+    return out
+
+
+# Vectorized version of the calculator formulas
+def presbyopic_plan(re_od, re_os, monovision_tolerance, extra_add):
+    re_od = np.asarray(re_od, dtype=np.float64)
+    re_os = np.asarray(re_os, dtype=np.float64)
+    monovision_tolerance = np.asarray(monovision_tolerance, dtype=np.float64)
+    extra_add = np.asarray(extra_add, dtype=np.float64)
+
+    return {
+        "re_final_refraction": _round2(re_od + extra_add),
+        "re_q_change": _round2(q_per_d * extra_add),
+        "le_final_refraction": _round2(re_os + monovision_tolerance + extra_add),
+        "le_q_change": _round2(q_per_d * monovision_tolerance),
+    }
+
+
+def _format_of(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+# (input line number, row) pairs; a JSONL line that is not a JSON object comes back as row None
+def _read_rows(f, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_num, row if isinstance(row, dict) else None
+
+
+# Input values of one row, or the reason it cannot be evaluated
+def _parse_row(row):
+    if row is None:
+        return None, "not a JSON object"
+    values = []
+    for name in input_fields:
+        try:
+            value = float(row[name])
+        except KeyError:
+            return None, f"missing {name}"
+        except (TypeError, ValueError):
+            return None, f"{name} is not a number: {row[name]!r}"
+        if not math.isfinite(value):
+            return None, f"{name} is not finite: {row[name]!r}"
+        values.append(value)
+    return values, None
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Evaluate every row of fin into fout; returns (rows written, rows skipped)
+def process_stream(fin, fout, in_format="csv", out_format="csv", chunk_size=100_000, errors=sys.stderr):
+    writer = None
+    count = 0
+    skipped = 0
+    for chunk in _chunks(_read_rows(fin, in_format), chunk_size):
+        rows, values = [], []
+        for line_num, row in chunk:
+            parsed, reason = _parse_row(row)
+            if parsed is None:
+                skipped += 1
+                if skipped <= max_reported_errors:
+                    print(f"line {line_num}: skipped, {reason}", file=errors)
+                continue
+            rows.append(row)
+            values.append(parsed)
+        if not rows:
+            continue
+        chunk = rows
+        columns = dict(zip(input_fields, np.array(values, dtype=np.float64).T))
+        results = presbyopic_plan(**columns)
+        results = {name: results[name].tolist() for name in result_fields}
+
+        if out_format == "csv":
+            if writer is None:
+                fieldnames = [name for name in chunk[0] if name not in result_fields] + result_fields
+                writer = csv.DictWriter(fout, fieldnames=fieldnames, extrasaction="ignore")
+                writer.writeheader()
+            for i, row in enumerate(chunk):
+                row.update({name: results[name][i] for name in result_fields})
+            writer.writerows(chunk)
+        else:
+            for i, row in enumerate(chunk):
+                row.update({name: results[name][i] for name in result_fields})
+                fout.write(json.dumps(row) + "\n")
+        count += len(chunk)
+    return count, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch presbyopic LASIK calculator")
+    parser.add_argument("input", help="CSV or JSONL file, or - for stdin")
+    parser.add_argument("output", help="CSV or JSONL file, or - for stdout")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="input format (default: from extension)")
+    parser.add_argument("--output-format", choices=["csv", "jsonl"], help="output format (default: from extension)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="rows evaluated per vectorized step")
+    args = parser.parse_args(argv)
+
+    in_format = _format_of(args.input, args.format)
+    out_format = _format_of(args.output, args.output_format or (args.format if args.output == "-" else None))
+
+    fin = sys.stdin if args.input == "-" else open(args.input, newline="", encoding="utf-8")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        count, skipped = process_stream(fin, fout, in_format, out_format, args.chunk_size)
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    print(f"Processed {count} rows", file=sys.stderr)
+    if skipped:
+        print(f"Skipped {skipped} rows with missing or invalid inputs", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Online recursive-least-squares updates of the DOF coefficients.
+
+Each new outcome record updates the coefficients at O(1) cost; the estimator state is a few
+small arrays in one .npz file. Publishing writes a new coefficient version through
+calibration.save_coefficients, which running apps pick up on their next rerun.
+
+The state records the latest coefficient version it accounts for (the one it was seeded from, or
+its own last publish). When a newer version exists, e.g. a full refit by calibration.py, the
+state is re-seeded from it, so a publish never reverts that refit.
+
+Published versions carry no bootstrap samples, so the apps' DOF confidence bands are unavailable
+for them until calibration.py --bootstrap N writes a new version.
+
+    python online_calibration.py new_outcomes.csv --publish
+"""
+import argparse
+import os
+
+import numpy as np
+
+import calibration
+
+state_path = os.path.join(calibration.coefficients_dir, "rls_state.npz")
+
+# Linear-in-parameters forms, with the pupil term (reference and exponent) held at its current value:
+#   se:     dof   = slope * X - (slope * k) * X * sa,  X = se * (pupil_ref / pupil)^exponent
+#   q:      q_dof = q_to_dof * q_delta
+#   myopic: dof   = c * sa + (c * induction) * T       while sa + induction * T is below the cap
+#   cap:    dof   = (c * cap)                          once it is capped
+groups = ("se", "q", "myopic", "cap")
+
+
+def _initial_theta(c):
+    return {
+        "se": np.array([c["se_slope"], c["se_slope"] * c["sa_k"]]),
+        "q": np.array([c["q_to_dof"]]),
+        "myopic": np.array([c["myopia_dof_per_sa"], c["myopia_dof_per_sa"] * c["myopia_induction"]]),
+        "cap": np.array([c["myopia_dof_per_sa"] * c["myopia_sa_cap"]]),
+    }
+
+
+def _column(data, name, n):
+    return np.asarray(data[name], dtype=np.float64) if name in data else np.full(n, np.nan)
+
+
+class OnlineCalibrator:
+    # prior_variance sets how far the first records can move the starting coefficients;
+    # forgetting < 1 discounts old records geometrically. version is the coefficient version
+    # the starting coefficients come from (the latest published set when coefficients is None).
+    def __init__(self, coefficients=None, prior_variance=10.0, forgetting=1.0, version=0):
+        if coefficients is None:
+            coefficients, version = calibration.load_coefficients(with_version=True)
+        self.base = dict(coefficients)
+        self.version = version
+        self.forgetting = forgetting
+        self.theta = _initial_theta(self.base)
+        self.P = {g: np.eye(len(t)) * prior_variance for g, t in self.theta.items()}
+        self.n = dict.fromkeys(groups, 0)
+
+    def _update(self, group, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        P, theta, lam = self.P[group], self.theta[group], self.forgetting
+        Px = P @ x
+        gain = Px / (lam + x @ Px)
+        theta += gain * (y - x @ theta)
+        self.P[group] = (P - np.outer(gain, Px)) / lam
+        self.n[group] += 1
+
+    # One hyperopic outcome: SE-induced DOF and, when measured, the Q-induced DOF
+    def add_hyperopic(self, se, sa_preop, pupil, dof, q_delta=None, q_dof=None):
+        if se > 0 and not np.isnan(dof):
+            X = se * (self.base["pupil_ref"] / pupil)**self.base["pupil_exponent"]
+            self._update("se", (X, -X * sa_preop), dof)
+        if q_delta is not None and q_dof is not None and not (np.isnan(q_delta) or np.isnan(q_dof)):
+            self._update("q", (q_delta,), q_dof)
+
+    # One myopic outcome; routed to the linear or the capped form by the current estimate.
+    # Rows missing the sphere, SA or DOF cannot be routed and are skipped.
+    def add_myopic(self, sphere, cyl, sa_preop, dof):
+        if np.isnan(sphere) or np.isnan(sa_preop) or np.isnan(dof):
+            return
+        total_myopia = abs(sphere) + abs(cyl)
+        c = self.coefficients()
+        if sa_preop + c["myopia_induction"] * total_myopia < c["myopia_sa_cap"]:
+            self._update("myopic", (sa_preop, total_myopia), dof)
+        else:
+            self._update("cap", (1.0,), dof)
+
+    # Feed a dataset (dict of columns, as calibration.load_outcomes returns) row by row
+    def add_outcomes(self, data):
+        n = len(next(iter(data.values())))
+        model = data.get("model", np.full(n, "hyperopic"))
+        se, sa, pupil, dof, q_delta, q_dof, sphere, cyl = (
+            _column(data, name, n) for name in ("se", "sa_preop", "pupil", "dof", "q_delta", "q_dof", "sphere", "cyl"))
+        for i in range(n):
+            if model[i] == "myopic":
+                self.add_myopic(sphere[i], np.nan_to_num(cyl[i]), sa[i], dof[i])
+            elif not np.isnan(sa[i]):
+                self.add_hyperopic(se[i], sa[i], pupil[i] if not np.isnan(pupil[i]) else calibration.default_pupil, dof[i], q_delta[i], q_dof[i])
+
+    def coefficients(self):
+        c = dict(self.base)
+        slope, slope_k = self.theta["se"]
+        dof_per_sa, dof_induction = self.theta["myopic"]
+        c.update(
+            se_slope=float(slope),
+            sa_k=float(slope_k / slope),
+            q_to_dof=float(self.theta["q"][0]),
+            myopia_dof_per_sa=float(dof_per_sa),
+            myopia_induction=float(dof_induction / dof_per_sa),
+            myopia_sa_cap=float(self.theta["cap"][0] / dof_per_sa),
+        )
+        return c
+
+    def save(self, path=state_path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {"base": np.array([self.base[name] for name in calibration.default_coefficients]),
+                  "forgetting": np.array(self.forgetting), "version": np.array(self.version)}
+        for g in groups:
+            arrays[f"theta_{g}"] = self.theta[g]
+            arrays[f"P_{g}"] = self.P[g]
+            arrays[f"n_{g}"] = np.array(self.n[g])
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=state_path):
+        with np.load(path) as f:
+            # States written before the version was recorded count as seeded from no version
+            version = int(f["version"]) if "version" in f.files else 0
+            est = cls(dict(zip(calibration.default_coefficients, f["base"].tolist())), forgetting=float(f["forgetting"]),
+                      version=version)
+            for g in groups:
+                est.theta[g] = f[f"theta_{g}"].copy()
+                est.P[g] = f[f"P_{g}"].copy()
+                est.n[g] = int(f[f"n_{g}"])
+        return est
+
+    # Write the current estimate as a new coefficient version for the running apps
+    def publish(self, directory=calibration.coefficients_dir):
+        path = calibration.save_coefficients(self.coefficients(), directory, source="rls", records=dict(self.n),
+                                             seeded_from=self.version)
+        self.version = calibration.path_version(path)
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update the ZOOM DOF coefficients with new outcomes")
+    parser.add_argument("outcomes", help="new outcome records: CSV or Parquet store directory")
+    parser.add_argument("--state", default=state_path, help="estimator state file (created if missing)")
+    parser.add_argument("--forgetting", type=float, default=1.0, help="forgetting factor for a new state")
+    parser.add_argument("--publish", action="store_true", help="write the updated coefficients as a new version")
+    parser.add_argument("--out", default=calibration.coefficients_dir, help="coefficient directory")
+    args = parser.parse_args(argv)
+
+    latest, latest_version = calibration.load_coefficients(args.out, with_version=True)
+    if os.path.exists(args.state):
+        est = OnlineCalibrator.load(args.state)
+        if latest_version > est.version:
+            print(f"Coefficient set v{latest_version} is newer than the state (v{est.version}); re-seeding from it")
+            est = OnlineCalibrator(latest, forgetting=est.forgetting, version=latest_version)
+    else:
+        est = OnlineCalibrator(latest, forgetting=args.forgetting, version=latest_version)
+    est.add_outcomes(calibration.load_outcomes(args.outcomes))
+    for name, value in est.coefficients().items():
+        print(f"{name:>20}: {value:.4f}")
+    if args.publish:
+        print(f"Wrote {est.publish(args.out)} (no bootstrap samples; run calibration.py --bootstrap N for DOF bands)")
+    est.save(args.state)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Columnar store for pre/post-op outcomes.
+
+Outcomes are kept as Parquet under a directory partitioned by model variant and surgeon
+(hive-style model=.../surgeon=.../), sorted by date inside each file. Queries read only the
+requested columns; model and surgeon filters skip whole partitions and date filters are pushed
+down to the row-group statistics.
+
+    python outcomes_store.py import outcomes.csv outcomes_parquet/
+    python outcomes_store.py query outcomes_parquet/ --columns se,sa_preop,dof --surgeon A --since 2025-01-01
+"""
+import argparse
+import os
+import sys
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+
+partition_columns = ("model", "surgeon")
+partitioning = ds.partitioning(pa.schema([("model", pa.string()), ("surgeon", pa.string())]), flavor="hive")
+row_group_size = 64 * 1024
+
+
+# Append records (dict of columns or a pyarrow Table) to the store. model, surgeon and date
+# (ISO date strings or dates) are required; every write adds new files, existing ones are kept.
+def write_outcomes(data, root):
+    table = data if isinstance(data, pa.Table) else pa.table(dict(data))
+    missing = {"date", *partition_columns} - set(table.column_names)
+    if missing:
+        raise ValueError(f"outcomes need columns {sorted(missing)}")
+    if not pa.types.is_date(table.schema.field("date").type):
+        table = table.set_column(table.schema.get_field_index("date"), "date", pc.cast(table["date"], pa.date32()))
+    for name in partition_columns:
+        table = table.set_column(table.schema.get_field_index(name), name, pc.cast(table[name], pa.string()))
+    table = table.sort_by([(name, "ascending") for name in (*partition_columns, "date")])
+    ds.write_dataset(
+        table, root, format="parquet", partitioning=partitioning,
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        min_rows_per_group=min(row_group_size, max(len(table), 1)), max_rows_per_group=row_group_size,
+    )
+
+
+def open_outcomes(root):
+    return ds.dataset(root, format="parquet", partitioning=partitioning)
+
+
+def _date(value):
+    return pa.scalar(np.datetime64(str(value), "D").astype(object), type=pa.date32())
+
+
+def _filter(surgeon=None, model=None, since=None, until=None):
+    expr = None
+    for column, value in (("surgeon", surgeon), ("model", model)):
+        if value is not None:
+            values = [value] if isinstance(value, str) else list(value)
+            term = ds.field(column).isin(values)
+            expr = term if expr is None else expr & term
+    if since is not None:
+        term = ds.field("date") >= _date(since)
+        expr = term if expr is None else expr & term
+    if until is not None:
+        term = ds.field("date") < _date(until)
+        expr = term if expr is None else expr & term
+    return expr
+
+
+# Read only the requested columns (all when None) of the rows matching the filters.
+# surgeon / model take one value or a list; since / until bound the date (until exclusive).
+# Returns a dict of NumPy columns, the same shape calibration.load_outcomes_csv returns.
+def query_outcomes(root, columns=None, surgeon=None, model=None, since=None, until=None):
+    table = open_outcomes(root).to_table(columns=list(columns) if columns else None,
+                                         filter=_filter(surgeon, model, since, until))
+    data = {}
+    for name in table.column_names:
+        col = table[name]
+        if pa.types.is_floating(col.type) or pa.types.is_integer(col.type):
+            data[name] = col.to_numpy(zero_copy_only=False).astype(np.float64)
+        elif pa.types.is_date(col.type):
+            data[name] = col.to_numpy(zero_copy_only=False).astype("datetime64[D]")
+        else:
+            data[name] = np.asarray(col.to_pylist(), dtype=object)
+    return data
+
+
+# Latest modification time of any file in the store, for cache keys
+def store_mtime(root):
+    return max((os.path.getmtime(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files), default=0.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parquet outcomes store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="append an outcomes CSV to the store")
+    imp.add_argument("csv")
+    imp.add_argument("root")
+    query = sub.add_parser("query", help="print matching rows")
+    query.add_argument("root")
+    query.add_argument("--columns", help="comma-separated columns (default: all)")
+    query.add_argument("--surgeon")
+    query.add_argument("--model")
+    query.add_argument("--since", help="first date, YYYY-MM-DD")
+    query.add_argument("--until", help="end date (exclusive), YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        table = pacsv.read_csv(args.csv, convert_options=pacsv.ConvertOptions(
+            column_types={"surgeon": pa.string(), "model": pa.string(), "date": pa.date32()}))
+        write_outcomes(table, args.root)
+        print(f"Imported {table.num_rows} rows into {args.root}")
+    else:
+        columns = args.columns.split(",") if args.columns else None
+        table = open_outcomes(args.root).to_table(columns=columns, filter=_filter(args.surgeon, args.model, args.since, args.until))
+        pacsv.write_csv(table, sys.stdout.buffer)
+
+
+if __name__ == "__main__":
+    main()
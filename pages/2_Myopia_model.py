@@ -1,8 +1,16 @@
 
+import sqlite3
+
 import streamlit as st
 import matplotlib.pyplot as plt
 import numpy as np
 
+import calibration
+import plan_store
+import power_vector
+import topo_import
+import zoom_engine
+
 st.set_page_config(page_title="ZOOM Simulator - Myopic LASIK Model", layout="wide")
 
 st.title("🔍 ZOOM Simulator – Myopic LASIK (No Q Modulation)")
@@ -12,10 +20,18 @@ st.sidebar.header("🔎 Refraction (RE & LE)")
 # Right Eye
 re_sphere = st.sidebar.number_input("RE Sphere (D)", -10.0, 0.0, 0.0, 0.25, key="re_sphere")
 re_cyl = st.sidebar.number_input("RE Cylinder (D)", -6.0, 0.0, 0.0, 0.25, key="re_cyl")
+re_axis = st.sidebar.number_input("RE Axis (°)", 0, 180, 180, 1, key="re_axis")
+re_M, re_J0, re_J45 = (float(v) for v in power_vector.to_power_vector(re_sphere, re_cyl, re_axis))
 
 # Left Eye
 le_sphere = st.sidebar.number_input("LE Sphere (D)", -10.0, 0.0, 0.0, 0.25, key="le_sphere")
 le_cyl = st.sidebar.number_input("LE Cylinder (D)", -6.0, 0.0, 0.0, 0.25, key="le_cyl")
+le_axis = st.sidebar.number_input("LE Axis (°)", 0, 180, 180, 1, key="le_axis")
+le_M, le_J0, le_J45 = (float(v) for v in power_vector.to_power_vector(le_sphere, le_cyl, le_axis))
+
+st.sidebar.header("📥 Topolyzer Elevation Import")
+
+topo_import.topography_sidebar(("sa",))
 
 st.sidebar.header("🌀 Preop Corneal Spherical Aberration (6mm)")
 sa_re = st.sidebar.number_input("RE Corneal SA (μm)", min_value=0.00, max_value=1.00, value=0.00, step=0.01, key="sa_re")
@@ -32,14 +48,19 @@ monovision_add = st.sidebar.slider("Monovision Add (D)", 0.0, 1.5, 0.0, 0.25)
 
 show_overlap = st.sidebar.checkbox("🔷 Show Binocular Overlap", value=False)
 
-def get_dof_myopia(sphere, cyl, preop_SA):
-    total_myopia = abs(sphere) + abs(cyl)
-    induced_SA = total_myopia * 0.045
-    postop_SA = min(preop_SA + induced_SA, 0.60)
-    dof = 3.0 * postop_SA
-    return round(dof * 4) / 4
+# Calibrated coefficients (latest version written by calibration.py, else the original literals)
+dof_coefficients, dof_coefficients_version = calibration.load_coefficients(with_version=True)
 
-def plot_eye(ax, label, bia, refraction, monovision, show_overlap=False, se_dof=0):
+# Bootstrap samples are fitted offline by calibration.py --bootstrap; the page only reads them
+st.sidebar.header("📊 DOF Confidence Bands (optional)")
+dof_bootstrap_path = calibration.bootstrap_path(dof_coefficients_version)
+show_dof_ci = st.sidebar.checkbox("Show bootstrap interval of the predicted DOF", value=False, key="show_dof_ci",
+                                  disabled=dof_bootstrap_path is None) and dof_bootstrap_path is not None
+if dof_bootstrap_path is None:
+    st.sidebar.caption("No bootstrap samples for the current coefficient set; run calibration.py with --bootstrap N.")
+myopic_coefficients = zoom_engine.myopic_dof_kwargs(dof_coefficients)
+
+def plot_eye(ax, label, bia, refraction, monovision, show_overlap=False, se_dof=0, se_dof_ci=None):
     net_shift = refraction + monovision
     retina_x = 0
     se_start = retina_x - net_shift
@@ -63,6 +84,11 @@ def plot_eye(ax, label, bia, refraction, monovision, show_overlap=False, se_dof=
     ax.fill_betweenx([-0.4, 0.4], bia_end, bia_start, color='yellow', alpha=0.4)
     ax.text(-2.5, 1.7, label, fontsize=11, weight='bold')
 
+    if se_dof_ci is not None:
+        # Bootstrap interval of the predicted (unrounded) DOF, measured from the red bar's start
+        ci_low, ci_high = se_dof_ci
+        ax.errorbar(se_start - (ci_low + ci_high) / 2, 0, xerr=(ci_high - ci_low) / 2, fmt='none', ecolor='darkred', elinewidth=1.5, capsize=6)
+
     if show_overlap:
         return (bia_end, se_start)
     return None
@@ -76,11 +102,17 @@ for ax in axs:
 re_mono = monovision_add if monovision_eye == "Right Eye" else 0
 le_mono = monovision_add if monovision_eye == "Left Eye" else 0
 
-re_dof_val = get_dof_myopia(re_sphere, re_cyl, sa_re)
-le_dof_val = get_dof_myopia(le_sphere, le_cyl, sa_le)
+# Treated myopia from the power vector (|M| + |J|), so the cylinder axis and sign convention drop out
+re_dof_val = float(zoom_engine.get_dof_myopia_from_vector(re_M, re_J0, re_J45, sa_re, **myopic_coefficients))
+le_dof_val = float(zoom_engine.get_dof_myopia_from_vector(le_M, le_J0, le_J45, sa_le, **myopic_coefficients))
 
-re_dof = plot_eye(axs[0], f"Right Eye", bia, re_refraction, re_mono, show_overlap, se_dof=re_dof_val)
-le_dof = plot_eye(axs[1], f"Left Eye", bia, le_refraction, le_mono, show_overlap, se_dof=le_dof_val)
+re_dof_ci = le_dof_ci = None
+if show_dof_ci:
+    re_dof_ci = calibration.dof_interval(dof_bootstrap_path, sa_re, sphere=re_sphere, cyl=re_cyl, model="myopic")
+    le_dof_ci = calibration.dof_interval(dof_bootstrap_path, sa_le, sphere=le_sphere, cyl=le_cyl, model="myopic")
+
+re_dof = plot_eye(axs[0], f"Right Eye", bia, re_refraction, re_mono, show_overlap, se_dof=re_dof_val, se_dof_ci=re_dof_ci)
+le_dof = plot_eye(axs[1], f"Left Eye", bia, le_refraction, le_mono, show_overlap, se_dof=le_dof_val, se_dof_ci=le_dof_ci)
 
 if show_overlap and re_dof and le_dof:
     start_overlap = max(re_dof[0], le_dof[0])
@@ -95,9 +127,12 @@ if show_overlap and re_dof and le_dof:
 
 plt.tight_layout()
 st.pyplot(fig)
+plt.close(fig)
 
 st.markdown("#### ⚠️ Disclaimer")
 st.markdown("This simulator models DOF induced by myopic treatment based on corneal spherical aberration changes. Valid for 6.0 mm OZ only. Not to be used for hyperopic or Q-modulated treatments.")
+if dof_coefficients_version:
+    st.caption(f"DOF coefficients: calibrated set v{dof_coefficients_version}")
 
 st.markdown("### 🧾 Final Treatment Plan")
 final_re_sphere = re_sphere + re_refraction + re_mono
@@ -105,4 +140,60 @@ final_le_sphere = le_sphere + le_refraction + le_mono
 st.write(f"**Right Eye Final Sphere:** {final_re_sphere:.2f} D")
 st.write(f"**Left Eye Final Sphere:** {final_le_sphere:.2f} D")
 
-
+for eye_name, M, J0, J45 in (("Right Eye", re_M, re_J0, re_J45), ("Left Eye", le_M, le_J0, le_J45)):
+    st.write(f"**{eye_name} Power Vector:** M = {M:.2f} D, J0 = {J0:.2f} D, J45 = {J45:.2f} D, "
+             f"blur strength = {float(power_vector.blur_strength(M, J0, J45)):.2f} D")
+
+
+@st.cache_resource
+def open_plan_store():
+    return plan_store.PlanStore()
+
+
+re_plan_bars = zoom_engine.bar_endpoints(0.0, bia, re_refraction, re_mono, re_dof_val)
+le_plan_bars = zoom_engine.bar_endpoints(0.0, bia, le_refraction, le_mono, le_dof_val)
+# Without Q modulation each bar ends at its SE start
+plan_overlap = float(zoom_engine.binocular_overlap(re_plan_bars[3], re_plan_bars[0], le_plan_bars[3], le_plan_bars[0])[2])
+plan_patient = st.text_input("Patient ID for this plan", key="plan_patient_id")
+if st.button("💾 Save Plan", disabled=not plan_patient, key="save_plan"):
+    plan = {
+        "re": {"sphere": re_sphere, "cyl": re_cyl, "axis": re_axis, "sa": sa_re, "refraction_add": re_refraction,
+               "monovision_add": re_mono, "dof": re_dof_val, "final_sphere": final_re_sphere},
+        "le": {"sphere": le_sphere, "cyl": le_cyl, "axis": le_axis, "sa": sa_le, "refraction_add": le_refraction,
+               "monovision_add": le_mono, "dof": le_dof_val, "final_sphere": final_le_sphere},
+        "bia": bia,
+        "dof_coefficients_version": dof_coefficients_version,
+    }
+    # Saved before the list below is read, so the new plan shows up and failures are reported
+    try:
+        plan_id = open_plan_store().save_plan(
+            plan_patient, "myopic", plan, poor_fusion=bool(zoom_engine.is_poor_fusion(plan_overlap)),
+            overlap=plan_overlap, re_final_sphere=final_re_sphere, le_final_sphere=final_le_sphere)
+    except (sqlite3.Error, ValueError) as e:
+        st.error(f"Could not save the plan: {e}")
+    else:
+        st.success(f"Plan {plan_id} saved for patient {plan_patient}")
+if plan_patient:
+    saved_plans = open_plan_store().find_plans(patient_id=plan_patient, limit=10)
+    if saved_plans:
+        st.caption("Saved plans for this patient (newest first)")
+        st.dataframe(saved_plans)
+
+
+
+with st.expander("🎯 Optic Zone Explorer"):
+    st.caption(f"DOF at each candidate optic zone with SA induction scaled as {dof_coefficients['myopia_induction']:.3f} μm/D × (6.0 / OZ)^exponent. Outside the 6.0 mm OZ this is a planning estimate only.")
+    target_dof = st.slider("Target DOF (D)", 0.25, 1.75, 1.0, 0.25, key="target_dof")
+    oz_exponent = st.slider("SA-vs-OZ exponent", 0.0, 4.0, 2.0, 0.5, key="oz_exponent")
+    oz_dof, oz_sa = zoom_engine.myopic_dof_over_oz([re_sphere, le_sphere], [re_cyl, le_cyl], [sa_re, sa_le], exponent=oz_exponent, **myopic_coefficients)
+    best_oz = zoom_engine.best_oz_for_target([re_sphere, le_sphere], [re_cyl, le_cyl], [sa_re, sa_le], target_dof, exponent=oz_exponent, **myopic_coefficients)
+    table = {"OZ (mm)": zoom_engine.oz_candidates}
+    for eye_idx, eye_label in enumerate(["RE", "LE"]):
+        table[f"{eye_label} Postop SA (μm)"] = oz_sa[eye_idx]
+        table[f"{eye_label} DOF (D)"] = oz_dof[eye_idx]
+    st.table(table)
+    for eye_idx, eye_name in enumerate(["Right Eye", "Left Eye"]):
+        if np.isnan(best_oz[eye_idx]):
+            st.write(f"**{eye_name}:** no candidate OZ reaches {target_dof:.2f} D within the {dof_coefficients['myopia_sa_cap']:.2f} μm SA cap")
+        else:
+            st.write(f"**{eye_name}:** largest OZ reaching {target_dof:.2f} D within the {dof_coefficients['myopia_sa_cap']:.2f} μm SA cap is {best_oz[eye_idx]:.2f} mm")
@@ -0,0 +1,105 @@
+import json
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Local SQLite store for treatment plans. WAL mode lets readers run while a save is being written,
+# and a small pool of connections is shared by every Streamlit session.
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zoom_plans.sqlite3")
+plan_models = ("hyperopic", "myopic")
+
+schema = """
+CREATE TABLE IF NOT EXISTS plans (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    model TEXT NOT NULL CHECK (model IN ('hyperopic', 'myopic')),
+    poor_fusion INTEGER NOT NULL DEFAULT 0,
+    overlap REAL,
+    re_final_sphere REAL,
+    le_final_sphere REAL,
+    plan TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plans_patient ON plans (patient_id, created_at);
+CREATE INDEX IF NOT EXISTS plans_created ON plans (created_at);
+CREATE INDEX IF NOT EXISTS plans_model ON plans (model, created_at);
+CREATE INDEX IF NOT EXISTS plans_fusion ON plans (poor_fusion, created_at);
+"""
+
+summary_columns = ("id", "patient_id", "created_at", "model", "poor_fusion", "overlap", "re_final_sphere", "le_final_sphere")
+
+
+class PlanStore:
+    def __init__(self, path=default_path, pool_size=4):
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+        with self.connection() as con:
+            con.executescript(schema)
+
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.row_factory = sqlite3.Row
+        return con
+
+    # Borrow a pooled connection; the block runs as one transaction
+    @contextmanager
+    def connection(self):
+        con = self._pool.get()
+        try:
+            with con:
+                yield con
+        finally:
+            self._pool.put(con)
+
+    def save_plan(self, patient_id, model, plan, poor_fusion=False, overlap=None,
+                  re_final_sphere=None, le_final_sphere=None, created_at=None):
+        if model not in plan_models:
+            raise ValueError(f"model must be one of {plan_models}, got {model!r}")
+        created_at = created_at or datetime.now(timezone.utc).isoformat(timespec="seconds")
+        with self.connection() as con:
+            cur = con.execute(
+                "INSERT INTO plans (patient_id, created_at, model, poor_fusion, overlap, re_final_sphere, le_final_sphere, plan)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(patient_id), created_at, model, int(bool(poor_fusion)), overlap, re_final_sphere, le_final_sphere,
+                 json.dumps(plan, default=float)),
+            )
+            return cur.lastrowid
+
+    # Plan summaries, newest first; every filter is optional and served by an index.
+    # since / until are ISO dates or timestamps.
+    def find_plans(self, patient_id=None, model=None, poor_fusion=None, since=None, until=None, limit=50):
+        where, params = [], []
+        for column, value in (("patient_id", patient_id), ("model", model)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if poor_fusion is not None:
+            where.append("poor_fusion = ?")
+            params.append(int(bool(poor_fusion)))
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(str(since))
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(str(until))
+        sql = f"SELECT {', '.join(summary_columns)} FROM plans"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        with self.connection() as con:
+            return [dict(row) for row in con.execute(sql, (*params, int(limit)))]
+
+    def load_plan(self, plan_id):
+        with self.connection() as con:
+            row = con.execute("SELECT plan FROM plans WHERE id = ?", (int(plan_id),)).fetchone()
+        return json.loads(row["plan"]) if row else None
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get().close()
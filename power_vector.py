@@ -0,0 +1,58 @@
+import numpy as np
+
+# Power-vector form of sphere / cylinder / axis (Thibos): M is the spherical equivalent, J0 and
+# J45 the Jackson cross-cylinder components. All functions broadcast over NumPy arrays.
+
+
+def to_power_vector(sphere, cyl, axis):
+    sphere = np.asarray(sphere, dtype=np.float64)
+    cyl = np.asarray(cyl, dtype=np.float64)
+    a = np.deg2rad(np.asarray(axis, dtype=np.float64))
+    M = sphere + cyl / 2
+    J0 = -cyl / 2 * np.cos(2 * a)
+    J45 = -cyl / 2 * np.sin(2 * a)
+    return M, J0, J45
+
+
+# Back to sphere / cylinder / axis (degrees, 0-180) in minus- or plus-cylinder notation
+def from_power_vector(M, J0, J45, cyl_sign="-"):
+    M = np.asarray(M, dtype=np.float64)
+    J = np.hypot(J0, J45)
+    if cyl_sign == "-":
+        cyl = -2 * J
+        axis = np.rad2deg(np.arctan2(J45, J0)) / 2
+    elif cyl_sign == "+":
+        cyl = 2 * J
+        axis = np.rad2deg(np.arctan2(-np.asarray(J45), -np.asarray(J0))) / 2
+    else:
+        raise ValueError(f"cyl_sign must be '-' or '+', got {cyl_sign!r}")
+    sphere = M - cyl / 2
+    axis = np.where(J < 1e-12, 0.0, np.mod(axis, 180.0))
+    return sphere, cyl, axis
+
+
+# Same prescription with the cylinder sign flipped
+def transpose(sphere, cyl, axis):
+    sphere = np.asarray(sphere, dtype=np.float64)
+    cyl = np.asarray(cyl, dtype=np.float64)
+    return sphere + cyl, -cyl, np.mod(np.asarray(axis, dtype=np.float64) + 90.0, 180.0)
+
+
+# Vector sum of prescriptions given as (sphere, cyl, axis) tuples, returned in minus cylinder
+def add_prescriptions(*prescriptions):
+    M = J0 = J45 = 0.0
+    for sphere, cyl, axis in prescriptions:
+        m, j0, j45 = to_power_vector(sphere, cyl, axis)
+        M, J0, J45 = M + m, J0 + j0, J45 + j45
+    return from_power_vector(M, J0, J45)
+
+
+# Blur strength (D): length of the power vector
+def blur_strength(M, J0, J45):
+    return np.sqrt(np.asarray(M)**2 + np.asarray(J0)**2 + np.asarray(J45)**2)
+
+
+# Dioptric treatment magnitude of the myopic model, |sphere| + |cyl| for a minus-cylinder
+# myopic prescription, written axis-free as |M| + |J|
+def myopic_treatment(M, J0, J45):
+    return np.abs(M) + np.hypot(J0, J45)
@@ -0,0 +1,93 @@
+import numpy as np
+
+from zoom_engine import _q_dof_factors, bar_endpoints, binocular_overlap
+
+# Hyperopic regression after LASIK: each eye's manifest sphere follows
+#   sphere(t) = plateau + (sphere at t=0 - plateau) exp(-t / tau)
+# fitted per eye by linear least squares in (plateau, amplitude) for every tau on a grid at once,
+# keeping the tau with the smallest residual.
+tau_grid = np.array([0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 9.0, 12.0])
+forecast_months = (3, 6, 12)
+
+
+# Long-form follow-up records -> (unique ids, months and sphere as (eyes, visits) arrays, NaN padded)
+def pivot_followups(eye_ids, months, sphere):
+    eye_ids = np.asarray(eye_ids)
+    months = np.asarray(months, dtype=np.float64)
+    sphere = np.asarray(sphere, dtype=np.float64)
+    ids, row = np.unique(eye_ids, return_inverse=True)
+    order = np.lexsort((months, row))
+    row, months, sphere = row[order], months[order], sphere[order]
+    counts = np.bincount(row, minlength=len(ids))
+    col = np.arange(len(row)) - np.repeat(np.cumsum(counts) - counts, counts)
+    wide_months = np.full((len(ids), counts.max(initial=0)), np.nan)
+    wide_sphere = np.full_like(wide_months, np.nan)
+    wide_months[row, col] = months
+    wide_sphere[row, col] = sphere
+    return ids, wide_months, wide_sphere
+
+
+# Fit every eye at once; months / sphere are (eyes, visits) with NaN for missing visits.
+# Eyes with visits at fewer than three distinct months (repeat visits at one month cannot
+# identify plateau and tau) get a flat curve at their mean sphere.
+def fit_regression(months, sphere, taus=tau_grid):
+    months = np.asarray(months, dtype=np.float64)
+    sphere = np.asarray(sphere, dtype=np.float64)
+    valid = ~(np.isnan(months) | np.isnan(sphere))
+    y = np.where(valid, sphere, 0.0)[:, np.newaxis, :]
+    w = valid[:, np.newaxis, :].astype(np.float64)
+    x = np.exp(-np.where(valid, months, 0.0)[:, np.newaxis, :] / taus[np.newaxis, :, np.newaxis]) * w
+
+    n = w.sum(axis=-1)
+    sx, sy = x.sum(axis=-1), y.sum(axis=-1)
+    sxx, sxy = (x * x).sum(axis=-1), (x * y).sum(axis=-1)
+    det = n * sxx - sx**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        amplitude = (n * sxy - sx * sy) / det
+        plateau = (sy - amplitude * sx) / n
+    sse = (((y - plateau[..., np.newaxis] - amplitude[..., np.newaxis] * x) * w)**2).sum(axis=-1)
+    sse = np.where(np.isfinite(sse), sse, np.inf)
+    best = np.argmin(sse, axis=-1)
+    pick = np.arange(len(best))
+
+    n_points = valid.sum(axis=-1)
+    sorted_months = np.sort(np.where(valid, months, np.inf), axis=-1)
+    with np.errstate(invalid="ignore"):
+        new_month = np.isfinite(sorted_months) & (np.diff(sorted_months, axis=-1, prepend=-np.inf) > 1e-9)
+    n_months = new_month.sum(axis=-1)
+    enough = n_months >= 3
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, sphere, 0.0).sum(axis=-1) / n_points
+    return {
+        "plateau": np.where(enough, plateau[pick, best], mean),
+        "amplitude": np.where(enough, amplitude[pick, best], 0.0),
+        "tau": np.where(enough, taus[best], np.nan),
+        "n_points": n_points,
+        "n_months": n_months,
+    }
+
+
+# Forecast sphere of every fitted eye at the given months, shape (eyes, months)
+def forecast(fit, months=forecast_months):
+    t = np.asarray(months, dtype=np.float64)[np.newaxis, :]
+    decay = np.where(np.isnan(fit["tau"])[:, np.newaxis], 0.0, np.exp(-t / np.nan_to_num(fit["tau"], nan=1.0)[:, np.newaxis]))
+    return fit["plateau"][:, np.newaxis] + fit["amplitude"][:, np.newaxis] * decay
+
+
+# Per-eye plan values as a column against the months axis
+def _per_eye(a):
+    a = np.asarray(a, dtype=np.float64)
+    return a.reshape(-1, 1) if a.ndim else a
+
+
+# Binocular overlap implied by forecast manifest spheres of both eyes (D, myopic negative): the
+# residual myopia is the eye's shift in the bar model. Plan arrays broadcast against (eyes, months).
+# The per-eye Q->DOF factors (e.g. traced) default to the coefficient set's q_to_dof.
+def forecast_overlap(re_sphere, le_sphere, re_q, le_q, bia, re_se_dof, le_se_dof,
+                     re_q_dof_factor=None, le_q_dof_factor=None, coefficients=None):
+    re_q_dof_factor, le_q_dof_factor = _q_dof_factors(coefficients, re_q_dof_factor, le_q_dof_factor)
+    re_q, le_q, bia, re_se_dof, le_se_dof, re_q_dof_factor, le_q_dof_factor = (
+        _per_eye(a) for a in (re_q, le_q, bia, re_se_dof, le_se_dof, re_q_dof_factor, le_q_dof_factor))
+    _, _, _, re_bia_end, _, re_q_end = bar_endpoints(re_q, bia, -np.asarray(re_sphere), 0.0, re_se_dof, re_q_dof_factor)
+    _, _, _, le_bia_end, _, le_q_end = bar_endpoints(le_q, bia, -np.asarray(le_sphere), 0.0, le_se_dof, le_q_dof_factor)
+    return binocular_overlap(re_bia_end, re_q_end, le_bia_end, le_q_end)[2]
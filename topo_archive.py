@@ -0,0 +1,118 @@
+import os
+import struct
+
+import numpy as np
+
+import topography
+
+# Topography archive: one binary file of back-to-back exam records, each a fixed header followed
+# by the elevation grid as little-endian float32 (mm). An offset index is stored next to the
+# archive (<archive>.idx.npy) and extended with just the new records when the archive grows.
+header = struct.Struct("<4sI32s32s1sHHffff")
+magic = b"ZTOP"
+version = 1
+
+index_dtype = np.dtype([
+    ("exam_id", "S32"), ("patient_id", "S32"), ("eye", "S1"),
+    ("offset", "<i8"), ("ny", "<u2"), ("nx", "<u2"),
+    ("x0", "<f4"), ("dx", "<f4"), ("y0", "<f4"), ("dy", "<f4"),
+])
+
+
+# Append one exam to the archive; x and y are the regular grid coordinates (mm)
+def append_map(path, exam_id, patient_id, eye, elevation, x, y):
+    elevation = np.ascontiguousarray(elevation, dtype="<f4")
+    ny, nx = elevation.shape
+    with open(path, "ab") as f:
+        f.write(header.pack(magic, version, exam_id.encode(), patient_id.encode(), eye.encode(), ny, nx,
+                            float(x[0]), float(x[1] - x[0]), float(y[0]), float(y[1] - y[0])))
+        f.write(elevation.tobytes())
+
+
+# Scan record headers only (seeking over the grids) from byte start and return the offset index.
+# A trailing record that is still being appended (header or grid incomplete) is left out.
+def build_index(path, start=0):
+    records = []
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        pos = start
+        while pos + header.size <= size:
+            f.seek(pos)
+            fields = header.unpack(f.read(header.size))
+            if fields[0] != magic:
+                raise ValueError(f"Corrupt topography archive {path} at byte {pos}")
+            _, _, exam_id, patient_id, eye, ny, nx, x0, dx, y0, dy = fields
+            end = pos + header.size + ny * nx * 4
+            if end > size:
+                break
+            records.append((exam_id, patient_id, eye, pos + header.size, ny, nx, x0, dx, y0, dy))
+            pos = end
+    return np.array(records, dtype=index_dtype)
+
+
+class TopographyArchive:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx.npy"
+        index = np.load(self.index_path) if os.path.exists(self.index_path) else np.zeros(0, dtype=index_dtype)
+        self.index = self._extend(index)
+
+    @staticmethod
+    def _end(index):
+        if not len(index):
+            return 0
+        last = index[-1]
+        return int(last["offset"]) + int(last["ny"]) * int(last["nx"]) * 4
+
+    def _extend(self, index):
+        end = self._end(index)
+        if end < os.path.getsize(self.path):
+            new = build_index(self.path, end)
+            if len(new):
+                index = np.concatenate([index, new])
+                np.save(self.index_path, index)
+        return index
+
+    # Index exams appended since the last look; a size check when nothing changed
+    def refresh(self):
+        if self._end(self.index) < os.path.getsize(self.path):
+            self.index = self._extend(self.index)
+        return self
+
+    def __len__(self):
+        return len(self.index)
+
+    # Record numbers matching a patient and/or eye ("R" / "L"), including newly appended exams
+    def find(self, patient_id=None, eye=None):
+        self.refresh()
+        mask = np.ones(len(self.index), dtype=bool)
+        if patient_id is not None:
+            mask &= self.index["patient_id"] == patient_id.encode()
+        if eye is not None:
+            mask &= self.index["eye"] == eye.encode()
+        return np.flatnonzero(mask)
+
+    # Zero-copy read-only view of one elevation grid with its x / y coordinates
+    def open_map(self, i):
+        rec = self.index[i]
+        ny, nx = int(rec["ny"]), int(rec["nx"])
+        elevation = np.memmap(self.path, dtype="<f4", mode="r", offset=int(rec["offset"]), shape=(ny, nx))
+        x = rec["x0"] + rec["dx"] * np.arange(nx, dtype=np.float64)
+        y = rec["y0"] + rec["dy"] * np.arange(ny, dtype=np.float64)
+        return elevation, x, y
+
+    # Fit R, Q and SA for the given records, batch_size maps of one grid geometry at a time;
+    # maps whose fit is not plausible (topography's ok flag) are left NaN
+    def fit(self, records=None, batch_size=1000):
+        records = np.arange(len(self.index)) if records is None else np.asarray(records)
+        result = {name: np.full(len(records), np.nan) for name in ("R", "Q", "sa")}
+        geometry = self.index[records][["ny", "nx", "x0", "dx", "y0", "dy"]]
+        for geo in np.unique(geometry):
+            same = np.flatnonzero(geometry == geo)
+            for start in range(0, len(same), batch_size):
+                batch = same[start:start + batch_size]
+                maps = [self.open_map(records[j]) for j in batch]
+                fitted = topography.fit_elevation_maps(np.stack([m[0] for m in maps]), maps[0][1], maps[0][2])
+                for name in result:
+                    result[name][batch] = np.where(fitted["ok"], fitted[name], np.nan)
+        return result
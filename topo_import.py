@@ -0,0 +1,69 @@
+import os
+
+import streamlit as st
+
+import topo_archive
+import topography
+
+# Sidebar import of Topolyzer elevation grids, shared by the simulator pages. A fitted map fills
+# only the session-state inputs a page asks for, once per new source, so manual edits are kept.
+
+
+# Input values from a fit, clipped to the input ranges
+def _sa_input(topo):
+    return round(min(max(float(topo["sa"]), 0.0), 1.0), 2)
+
+
+def _radius_input(topo):
+    return round(min(max(float(topo["R"]), 6.5), 9.5) * 20) / 20
+
+
+def _base_q_input(topo):
+    return round(min(max(float(topo["Q"]), -1.5), 1.0), 2)
+
+
+# Session-state key and input value of each fitted quantity
+input_fields = {
+    "sa": ("sa_{eye}", _sa_input),
+    "radius": ("{eye}_radius", _radius_input),
+    "base_q": ("{eye}_base_q", _base_q_input),
+}
+
+
+@st.cache_resource
+def open_topo_archive(path):
+    return topo_archive.TopographyArchive(path)
+
+
+# Fill the inputs named in fields from one map, once per new source
+def apply_topography(topo_eye, source_id, elevation, x, y, fields):
+    if st.session_state.get(f"{topo_eye}_topo_id") == source_id:
+        return
+    topo = topography.fit_elevation_maps(elevation, x, y)
+    if not topo["ok"]:
+        st.sidebar.warning(f"{topo_eye.upper()}: the conic fit of this map failed or is implausible "
+                           f"(R = {float(topo['R']):.2f} mm, Q = {float(topo['Q']):.2f}); values not applied")
+        return
+    for field in fields:
+        key, value = input_fields[field]
+        st.session_state[key.format(eye=topo_eye)] = value(topo)
+    st.session_state[f"{topo_eye}_topo_id"] = source_id
+    st.sidebar.caption(f"{topo_eye.upper()}: R = {float(topo['R']):.2f} mm, Q = {float(topo['Q']):.2f}, SA(6mm) = {float(topo['sa']):.2f} μm")
+
+
+# Uploaders and archive lookup; fields names the inputs of input_fields the calling page has
+def topography_sidebar(fields):
+    for topo_eye in ("re", "le"):
+        topo_file = st.sidebar.file_uploader(f"{topo_eye.upper()} elevation grid (CSV, µm)", type=["csv"], key=f"{topo_eye}_topo")
+        if topo_file is not None:
+            apply_topography(topo_eye, topo_file.file_id, *topography.load_elevation_csv(topo_file), fields)
+
+    archive_path = st.sidebar.text_input("Topography archive path (optional)", key="topo_archive_path")
+    archive_patient = st.sidebar.text_input("Patient ID", key="topo_patient_id")
+    if archive_path and archive_patient and os.path.exists(archive_path):
+        archive = open_topo_archive(archive_path)
+        for topo_eye, eye_code in (("re", "R"), ("le", "L")):
+            exams = archive.find(archive_patient, eye_code)
+            if len(exams):
+                # Latest exam of that eye
+                apply_topography(topo_eye, f"{archive_path}:{exams[-1]}", *archive.open_map(exams[-1]), fields)
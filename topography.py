@@ -0,0 +1,170 @@
+import csv
+from functools import lru_cache
+from math import factorial
+
+import numpy as np
+
+# Fitting of Topolyzer anterior elevation grids: best-fit conic (R, Q), Zernike coefficients
+# over the 6 mm zone, and the corneal Z(4,0) used as the simulators' SA input.
+n_cornea = 1.376
+fit_zone_mm = 6.0
+zernike_order = 4
+
+
+# OSA/ANSI single-index j -> (n, m)
+def zernike_nm(j):
+    n = int(np.ceil((-3 + np.sqrt(9 + 8 * j)) / 2))
+    m = 2 * j - n * (n + 2)
+    return n, m
+
+
+def zernike(n, m, rho, theta):
+    radial = np.zeros_like(rho)
+    for s in range((n - abs(m)) // 2 + 1):
+        c = (-1)**s * factorial(n - s) / (factorial(s) * factorial((n + abs(m)) // 2 - s) * factorial((n - abs(m)) // 2 - s))
+        radial += c * rho**(n - 2 * s)
+    norm = np.sqrt(2 * (n + 1)) if m != 0 else np.sqrt(n + 1)
+    if m >= 0:
+        return norm * radial * np.cos(m * theta)
+    return norm * radial * np.sin(-m * theta)
+
+
+# Zernike design matrix and its pseudo-inverse for one grid geometry, built once.
+# Returns the flat indices of the grid points inside the zone, the basis and its pseudo-inverse.
+@lru_cache(maxsize=32)
+def zernike_basis(x0, dx, nx, y0, dy, ny, zone=fit_zone_mm, order=zernike_order):
+    x = x0 + dx * np.arange(nx)
+    y = y0 + dy * np.arange(ny)
+    xx, yy = np.meshgrid(x, y)
+    r = np.sqrt(xx**2 + yy**2).ravel()
+    inside = np.flatnonzero(r <= zone / 2)
+    rho = r[inside] / (zone / 2)
+    theta = np.arctan2(yy.ravel()[inside], xx.ravel()[inside])
+    n_terms = (order + 1) * (order + 2) // 2
+    basis = np.stack([zernike(*zernike_nm(j), rho, theta) for j in range(n_terms)], axis=1)
+    pinv = np.linalg.pinv(basis)
+    for a in (inside, basis, pinv):
+        a.flags.writeable = False
+    return inside, basis, pinv
+
+
+def _geometry(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return float(x[0]), float(x[1] - x[0]), len(x), float(y[0]), float(y[1] - y[0]), len(y)
+
+
+# Sag (mm) of a conic with apical radius R and asphericity Q
+def conic_sag(r, R, Q):
+    return r**2 / (R * (1 + np.sqrt(np.maximum(1 - (1 + Q) * r**2 / R**2, 0))))
+
+
+def _fit_zernike(z, valid, complete, basis, pinv):
+    coeffs = np.empty((z.shape[0], basis.shape[1]))
+    coeffs[complete] = z[complete] @ pinv.T
+    for i in np.flatnonzero(~complete):
+        coeffs[i] = np.linalg.lstsq(basis[valid[i]], z[i, valid[i]], rcond=None)[0]
+    return coeffs
+
+
+# Plausible range of a fitted anterior cornea; fits outside it (or non-finite) are flagged
+valid_R_mm = (5.0, 11.0)
+valid_Q = (-2.0, 1.5)
+
+
+# Best-fit conic z = z0 + sag(|(x, y) - (x0, y0)|; R, Q) per map, so an apex height offset and a
+# decentred apex do not leak into R and Q. With p = 1 + Q,
+#   (x - x0)^2 + (y - y0)^2 = 2R (z - z0) - p (z - z0)^2
+# expands to x^2 + y^2 = a1 x + a2 y + a3 z + a4 z^2 + a5, linear in a, so every map is one
+# 5 x 5 weighted least-squares solve. The normal equations are assembled from the moments
+# sum(w z^k f(x, y)) for the fixed point terms f below, one matrix product per power of z.
+_point_terms = ("1", "x", "y", "xx", "xy", "yy", "r2", "xr2", "yr2")
+# Design columns x, y, z, z^2, 1 as (point term, power of z)
+_design = [("x", 0), ("y", 0), ("1", 1), ("1", 2), ("1", 0)]
+_products = {("1", "1"): "1", ("1", "x"): "x", ("1", "y"): "y", ("x", "x"): "xx", ("x", "y"): "xy", ("y", "y"): "yy"}
+_normal_term = np.array([[_point_terms.index(_products[tuple(sorted((a, b), key=_point_terms.index))])
+                          for b, _ in _design] for a, _ in _design])
+_normal_power = np.array([[i + j for _, j in _design] for _, i in _design])
+_rhs_term = np.array([_point_terms.index({"1": "r2", "x": "xr2", "y": "yr2"}[a]) for a, _ in _design])
+_rhs_power = np.array([i for _, i in _design])
+
+
+# xx, yy (points), z (maps, points) with weights w (0 for missing points). Returns (R, Q, x0, y0, z0)
+# per map.
+def _fit_conic(xx, yy, z, w):
+    r2 = xx**2 + yy**2
+    terms = np.stack([np.ones_like(xx), xx, yy, xx * xx, xx * yy, yy * yy, r2, xx * r2, yy * r2], axis=1)
+    moments = np.empty((z.shape[0], 5, len(_point_terms)))
+    wz = w.copy()
+    for k in range(5):
+        moments[:, k] = wz @ terms
+        wz *= z
+    # A small ridge keeps maps with too few points from making the batched solve singular
+    normal = moments[:, _normal_power, _normal_term] + 1e-12 * np.eye(5)
+    a = np.linalg.solve(normal, moments[:, _rhs_power, _rhs_term][..., np.newaxis])[..., 0]
+    x0, y0, p = a[:, 0] / 2, a[:, 1] / 2, -a[:, 3]
+    # z0 solves p z0^2 - a3 z0 - c = 0 (c = a5 + x0^2 + y0^2); the root near the apex, in a form
+    # that stays finite as p -> 0
+    c = a[:, 4] + x0**2 + y0**2
+    z0 = -2 * c / (a[:, 2] + np.sqrt(np.maximum(a[:, 2]**2 + 4 * p * c, 0)))
+    R = (a[:, 2] - 2 * p * z0) / 2
+    return np.stack([R, p - 1, x0, y0, z0], axis=1)
+
+
+# Fit elevation maps (..., ny, nx) in mm on the regular grid x, y (mm). The apex need not be at
+# zero height nor at the grid origin: the conic fit includes an apex height and decentration.
+# Maps with missing points (NaN) inside the zone fall back to a per-map least-squares fit.
+# Returns R (mm), Q, the apex offset apex_xyz (mm), the Zernike coefficients of the elevation
+# (µm, OSA order), sa, the corneal Z(4,0) wavefront coefficient in µm over the zone, and ok,
+# False where the fit is non-finite or outside valid_R_mm / valid_Q.
+def fit_elevation_maps(elevation, x, y, zone=fit_zone_mm):
+    elevation = np.asarray(elevation, dtype=np.float64)
+    lead = elevation.shape[:-2]
+    inside, basis, pinv = zernike_basis(*_geometry(x, y), zone)
+    xx, yy = np.meshgrid(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    xx, yy = xx.ravel()[inside], yy.ravel()[inside]
+    z = elevation.reshape(-1, elevation.shape[-2] * elevation.shape[-1])[:, inside]
+    valid = ~np.isnan(z)
+    complete = valid.all(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        params = _fit_conic(xx, yy, np.where(valid, z, 0.0), valid.astype(np.float64))
+    R, Q, x0, y0, z0 = params.T
+
+    coeffs = _fit_zernike(z, valid, complete, basis, pinv) * 1000
+
+    # Corneal SA: Z(4,0) of a refracting conic, (n - 1) / (8 R^3) (Q + 1 / n^2) r^4, plus the
+    # refracted non-conic part of the elevation's own Z(4,0)
+    a4 = (zone / 2)**4
+    conic_sa = (n_cornea - 1) / (8 * R**3) * (Q + 1 / n_cornea**2) * a4 / (6 * np.sqrt(5)) * 1000
+    rho = np.hypot(xx - x0[:, np.newaxis], yy - y0[:, np.newaxis])
+    residual = z - z0[:, np.newaxis] - conic_sag(rho, R[:, np.newaxis], Q[:, np.newaxis])
+    residual_c40 = _fit_zernike(np.where(valid, residual, 0.0), valid, complete, basis, pinv)[:, 12]
+    sa = conic_sa + (n_cornea - 1) * residual_c40 * 1000
+
+    ok = np.isfinite(params).all(axis=1) & np.isfinite(sa)
+    ok &= (R >= valid_R_mm[0]) & (R <= valid_R_mm[1]) & (Q >= valid_Q[0]) & (Q <= valid_Q[1])
+    return {
+        "R": R.reshape(lead),
+        "Q": Q.reshape(lead),
+        "apex_xyz": np.stack([x0, y0, z0], axis=-1).reshape(lead + (3,)),
+        "sa": sa.reshape(lead),
+        "zernike": coeffs.reshape(lead + (basis.shape[1],)),
+        "ok": ok.reshape(lead),
+    }
+
+
+# Read a Topolyzer elevation CSV export: first row holds the x coordinates (mm), first column
+# the y coordinates (mm), blanks are missing points. Elevation is converted to mm.
+def load_elevation_csv(f, units="um"):
+    if isinstance(f, str):
+        with open(f, newline="", encoding="utf-8") as fh:
+            rows = list(csv.reader(fh))
+    else:
+        rows = list(csv.reader(line.decode("utf-8") if isinstance(line, bytes) else line for line in f))
+    x = np.array([float(v) for v in rows[0][1:]])
+    y = np.array([float(row[0]) for row in rows[1:]])
+    elevation = np.array([[float(v) if v.strip() else np.nan for v in row[1:]] for row in rows[1:]])
+    if units == "um":
+        elevation /= 1000
+    return elevation, x, y
@@ -0,0 +1,537 @@
+from functools import lru_cache
+
+import numpy as np
+
+import power_vector
+
+# Shared constants of the ZOOM / CAMP simulators. default_coefficients are the empirical DOF
+# constants the simulators shipped with; calibration.py fits replacements, which the functions
+# below take as keyword arguments or, for the plan helpers, as a whole coefficient set.
+default_coefficients = {
+    "se_slope": 0.25,
+    "pupil_ref": 4.0,
+    "pupil_exponent": 2.0,
+    "sa_k": 1.5,
+    "q_to_dof": 1.25 / 0.3,
+    "myopia_induction": 0.045,
+    "myopia_sa_cap": 0.60,
+    "myopia_dof_per_sa": 3.0,
+}
+q_to_dof = default_coefficients["q_to_dof"]
+near_line = -2.5
+# Short alias for the signature defaults below
+_c = default_coefficients
+
+
+# Keyword arguments of get_dof_from_se_array / expected_dof_over_pupil for a coefficient set
+# (default_coefficients when None); k, when given, overrides its sa_k
+def se_dof_kwargs(coefficients=None, k=None):
+    c = coefficients or default_coefficients
+    return dict(k=c["sa_k"] if k is None else k, slope=c["se_slope"], pupil_ref=c["pupil_ref"],
+                pupil_exponent=c["pupil_exponent"])
+
+
+# Keyword arguments of the myopic DOF functions for a coefficient set
+def myopic_dof_kwargs(coefficients=None):
+    c = coefficients or default_coefficients
+    return dict(induction=c["myopia_induction"], sa_cap=c["myopia_sa_cap"], dof_per_sa=c["myopia_dof_per_sa"])
+
+
+# Vectorized get_dof_from_se: se, sa_preop, pupil and k broadcast as NumPy arrays.
+# Gives the same quarter-diopter-rounded DOF as the scalar version, eye for eye.
+def get_dof_from_se_array(se, sa_preop, pupil=3.0, k=_c["sa_k"], slope=_c["se_slope"],
+                          pupil_ref=_c["pupil_ref"], pupil_exponent=_c["pupil_exponent"]):
+    dof = _se_dof_unrounded(se, sa_preop, pupil, k, slope, pupil_ref, pupil_exponent)
+    return np.round(dof * 4) / 4
+
+
+# The regression before quarter-diopter rounding (clipped at zero, zero for se == 0)
+def _se_dof_unrounded(se, sa_preop, pupil=3.0, k=_c["sa_k"], slope=_c["se_slope"],
+                      pupil_ref=_c["pupil_ref"], pupil_exponent=_c["pupil_exponent"]):
+    se = np.asarray(se, dtype=np.float64)
+    sa_preop = np.asarray(sa_preop, dtype=np.float64)
+    pupil = np.asarray(pupil, dtype=np.float64)
+    k = np.asarray(k, dtype=np.float64)
+
+    dof = (slope * se) * (pupil_ref / pupil)**pupil_exponent * (1 - k * sa_preop)
+    dof = np.maximum(dof, 0)
+    return np.where(se == 0, 0.0, dof)
+
+
+# Vectorized get_dof_myopia for whole columns of sphere / cyl / preop SA.
+# induction is the µm of SA induced per diopter treated, sa_cap the postop SA ceiling and
+# dof_per_sa the diopters of DOF per µm of postop SA.
+def get_dof_myopia_array(sphere, cyl, preop_SA, induction=_c["myopia_induction"], sa_cap=_c["myopia_sa_cap"],
+                         dof_per_sa=_c["myopia_dof_per_sa"]):
+    sphere = np.asarray(sphere, dtype=np.float64)
+    cyl = np.asarray(cyl, dtype=np.float64)
+    preop_SA = np.asarray(preop_SA, dtype=np.float64)
+
+    total_myopia = np.abs(sphere) + np.abs(cyl)
+    return _myopic_dof(total_myopia, preop_SA, induction, sa_cap, dof_per_sa)
+
+
+# Myopic DOF from a power vector (M, J0, J45), so the cylinder axis is kept
+def get_dof_myopia_from_vector(M, J0, J45, preop_SA, induction=_c["myopia_induction"], sa_cap=_c["myopia_sa_cap"],
+                               dof_per_sa=_c["myopia_dof_per_sa"]):
+    total_myopia = power_vector.myopic_treatment(M, J0, J45)
+    return _myopic_dof(total_myopia, np.asarray(preop_SA, dtype=np.float64), induction, sa_cap, dof_per_sa)
+
+
+def _myopic_dof(total_myopia, preop_SA, induction, sa_cap, dof_per_sa=_c["myopia_dof_per_sa"]):
+    induced_SA = total_myopia * induction
+    postop_SA = np.minimum(preop_SA + induced_SA, sa_cap)
+    dof = dof_per_sa * postop_SA
+    return np.round(dof * 4) / 4
+
+
+# Optical-zone dependence of myopic SA induction: induction(oz) = induction * (reference_oz / oz)**exponent,
+# so the calibrated induction (µm/D) applies at the 6.0 mm reference OZ
+reference_oz = 6.0
+oz_candidates = np.arange(5.5, 7.0 + 1e-9, 0.25)
+
+
+def induction_for_oz(oz, induction=_c["myopia_induction"], exponent=2.0):
+    return induction * (reference_oz / np.asarray(oz, dtype=np.float64))**exponent
+
+
+# Myopic DOF of every eye at every candidate OZ in one pass, shape (eyes, OZs).
+# Also returns the uncapped postop SA, so callers can see which OZs stay within sa_cap.
+def myopic_dof_over_oz(sphere, cyl, preop_SA, oz=oz_candidates, induction=_c["myopia_induction"], exponent=2.0,
+                       sa_cap=_c["myopia_sa_cap"], dof_per_sa=_c["myopia_dof_per_sa"]):
+    total_myopia = (np.abs(np.asarray(sphere, dtype=np.float64)) + np.abs(np.asarray(cyl, dtype=np.float64)))[..., np.newaxis]
+    preop_SA = np.asarray(preop_SA, dtype=np.float64)[..., np.newaxis]
+    postop_SA = preop_SA + total_myopia * induction_for_oz(oz, induction, exponent)
+    return _myopic_dof(total_myopia, preop_SA, induction_for_oz(oz, induction, exponent), sa_cap, dof_per_sa), postop_SA
+
+
+# Largest candidate OZ whose DOF reaches target_dof with the postop SA within sa_cap (NaN if none)
+def best_oz_for_target(sphere, cyl, preop_SA, target_dof, oz=oz_candidates, induction=_c["myopia_induction"], exponent=2.0,
+                       sa_cap=_c["myopia_sa_cap"], dof_per_sa=_c["myopia_dof_per_sa"]):
+    oz = np.asarray(oz, dtype=np.float64)
+    dof, postop_SA = myopic_dof_over_oz(sphere, cyl, preop_SA, oz, induction, exponent, sa_cap, dof_per_sa)
+    ok = (dof >= target_dof) & (postop_SA <= sa_cap)
+    best = np.where(ok, oz, -np.inf).max(axis=-1)
+    return np.where(ok.any(axis=-1), best, np.nan)
+
+
+# Hyperopic (CAMP) plan pipeline, UI-free and vectorized over patients.
+monovision_eyes = ["None", "Right Eye", "Left Eye"]
+poor_fusion_threshold = 0.75
+# Overlap (D) below which the app draws no overlap, and so shows no fusion warning either
+min_drawn_overlap = 0.01
+
+
+# Poor fusion as the app warns about it: an overlap is drawn but is below poor_fusion_threshold
+def is_poor_fusion(overlap):
+    overlap = np.asarray(overlap)
+    return (overlap > min_drawn_overlap) & (overlap < poor_fusion_threshold)
+
+
+patient_dtype = np.dtype([
+    ("re_sphere", "f8"), ("re_cyl", "f8"),
+    ("le_sphere", "f8"), ("le_cyl", "f8"),
+    ("sa_re", "f8"), ("sa_le", "f8"),
+    ("bia", "f8"),
+    ("re_q", "f8"), ("le_q", "f8"),
+    ("re_refraction", "f8"), ("le_refraction", "f8"),
+    ("monovision_eye", "i1"),  # index into monovision_eyes
+    ("monovision_add", "f8"),
+])
+
+
+# Per-eye Q->DOF factors, defaulting to the coefficient set's q_to_dof (e.g. unless traced factors are given)
+def _q_dof_factors(coefficients, re_q_dof_factor, le_q_dof_factor):
+    c = coefficients or default_coefficients
+    return tuple(c["q_to_dof"] if f is None else f for f in (re_q_dof_factor, le_q_dof_factor))
+
+
+# Red / yellow / green bar endpoints exactly as drawn by plot_eye
+def bar_endpoints(q_delta, bia, refraction, monovision, se_dof, q_dof_factor=q_to_dof):
+    q_dof = np.asarray(q_delta) * q_dof_factor
+    net_shift = np.asarray(refraction) + monovision
+    retina_x = 0
+
+    se_start = retina_x - net_shift
+    se_end = se_start - se_dof
+    bia_start = se_end
+    bia_end = bia_start - bia
+    q_start = retina_x - net_shift
+    q_end = q_start + q_dof
+    return se_start, se_end, bia_start, bia_end, q_start, q_end
+
+
+# Overlap of the two eyes' ranges, as in the "Show Binocular Overlap" block
+def binocular_overlap(re_bia_end, re_q_end, le_bia_end, le_q_end):
+    start_overlap = np.maximum(re_bia_end, le_bia_end)
+    end_overlap = np.minimum(re_q_end, le_q_end)
+    overlap = np.maximum(0, end_overlap - start_overlap)
+    return start_overlap, end_overlap, overlap
+
+
+# Evaluate a structured array of patients (patient_dtype) into a columnar plan table.
+# coefficients is a DOF coefficient set (default_coefficients when None); k, when given, overrides its sa_k.
+def evaluate_plans(patients, pupil=3.0, k=None, coefficients=None):
+    dof_kwargs = se_dof_kwargs(coefficients, k)
+    q_dof_factor, _ = _q_dof_factors(coefficients, None, None)
+    p = np.asarray(patients)
+    se_re = p["re_sphere"] + (p["re_cyl"] / 2)
+    se_le = p["le_sphere"] + (p["le_cyl"] / 2)
+
+    re_mono = np.where(p["monovision_eye"] == 1, p["monovision_add"], 0.0)
+    le_mono = np.where(p["monovision_eye"] == 2, p["monovision_add"], 0.0)
+
+    re_se_dof = get_dof_from_se_array(se_re, p["sa_re"], pupil, **dof_kwargs)
+    le_se_dof = get_dof_from_se_array(se_le, p["sa_le"], pupil, **dof_kwargs)
+
+    re_bars = bar_endpoints(p["re_q"], p["bia"], p["re_refraction"], re_mono, re_se_dof, q_dof_factor)
+    le_bars = bar_endpoints(p["le_q"], p["bia"], p["le_refraction"], le_mono, le_se_dof, q_dof_factor)
+    start_overlap, end_overlap, overlap = binocular_overlap(re_bars[3], re_bars[5], le_bars[3], le_bars[5])
+
+    plan = {
+        "se_re": se_re,
+        "se_le": se_le,
+        "re_mono": re_mono,
+        "le_mono": le_mono,
+        "re_se_dof": re_se_dof,
+        "le_se_dof": le_se_dof,
+    }
+    names = ("se_start", "se_end", "bia_start", "bia_end", "q_start", "q_end")
+    for name, re_val, le_val in zip(names, re_bars, le_bars):
+        plan[f"re_{name}"] = np.broadcast_to(re_val, se_re.shape)
+        plan[f"le_{name}"] = np.broadcast_to(le_val, se_re.shape)
+    plan.update({
+        "start_overlap": start_overlap,
+        "end_overlap": end_overlap,
+        "binocular_overlap": overlap,
+        "poor_fusion": is_poor_fusion(overlap),
+        "final_re_sphere": p["re_sphere"] + p["re_refraction"] + re_mono,
+        "final_le_sphere": p["le_sphere"] + p["le_refraction"] + le_mono,
+        "re_q_change": p["re_q"],
+        "le_q_change": p["le_q"],
+    })
+    return plan
+
+
+# SE-induced DOF and Q->DOF factor of both eyes for the plan searches; k and the per-eye
+# factors, when given, override the coefficient set
+def _eye_dofs(re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, pupil, k, re_q_dof_factor, le_q_dof_factor, coefficients):
+    dof_kwargs = se_dof_kwargs(coefficients, k)
+    re_se_dof = get_dof_from_se_array(re_sphere + (re_cyl / 2), sa_re, pupil, **dof_kwargs)
+    le_se_dof = get_dof_from_se_array(le_sphere + (le_cyl / 2), sa_le, pupil, **dof_kwargs)
+    return (re_se_dof, le_se_dof, *_q_dof_factors(coefficients, re_q_dof_factor, le_q_dof_factor))
+
+
+# Discrete slider lattice of the hyperopic simulator
+q_steps = np.round(np.arange(0.0, 0.36 + 1e-9, 0.06), 2)
+refraction_steps = np.arange(0.0, 6.0 + 1e-9, 0.25)
+monovision_steps = np.arange(0.0, 1.5 + 1e-9, 0.25)
+overlap_target = (1.0, 1.5)
+
+
+# Score every slider combination for one patient and return the top_n plans (lowest score first).
+# Score = D outside the overlap target + D short of the near line + D short of the retina,
+# plus a small treatment_cost per D of added refraction / monovision so simpler plans win ties.
+# The per-eye Q->DOF factors default to the coefficient set's q_to_dof.
+def suggest_plans(re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, bia, top_n=5,
+                  pupil=3.0, k=None, treatment_cost=0.01, re_q_dof_factor=None, le_q_dof_factor=None, coefficients=None):
+    re_se_dof, le_se_dof, re_q_dof_factor, le_q_dof_factor = _eye_dofs(
+        re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, pupil, k, re_q_dof_factor, le_q_dof_factor, coefficients)
+
+    # Lattice axes: (monovision eye, monovision add, re_q, re_refraction, le_q, le_refraction)
+    eye = np.arange(len(monovision_eyes)).reshape(-1, 1, 1, 1, 1, 1)
+    mono = monovision_steps.reshape(1, -1, 1, 1, 1, 1)
+    re_q = q_steps.reshape(1, 1, -1, 1, 1, 1)
+    re_refraction = refraction_steps.reshape(1, 1, 1, -1, 1, 1)
+    le_q = q_steps.reshape(1, 1, 1, 1, -1, 1)
+    le_refraction = refraction_steps.reshape(1, 1, 1, 1, 1, -1)
+
+    re_mono = np.where(eye == 1, mono, 0.0)
+    le_mono = np.where(eye == 2, mono, 0.0)
+
+    _, _, _, re_bia_end, _, re_q_end = bar_endpoints(re_q, bia, re_refraction, re_mono, re_se_dof, re_q_dof_factor)
+    _, _, _, le_bia_end, _, le_q_end = bar_endpoints(le_q, bia, le_refraction, le_mono, le_se_dof, le_q_dof_factor)
+    _, _, overlap = binocular_overlap(re_bia_end, re_q_end, le_bia_end, le_q_end)
+
+    low, high = overlap_target
+    score = np.maximum(low - overlap, 0) + np.maximum(overlap - high, 0)
+    score = score + np.maximum(np.minimum(re_bia_end, le_bia_end) - near_line, 0)
+    score = score + np.maximum(0 - np.maximum(re_q_end, le_q_end), 0)
+    score = score + treatment_cost * (re_refraction + le_refraction + re_mono + le_mono)
+    # "None" with a non-zero add repeats the zero-add plan
+    score = np.where((eye == 0) & (mono > 0), np.inf, score)
+
+    flat = score.ravel()
+    top_n = min(top_n, flat.size)
+    best = np.argpartition(flat, top_n - 1)[:top_n]
+    best = best[np.argsort(flat[best], kind="stable")]
+    idx = np.unravel_index(best, score.shape)
+
+    return {
+        "score": flat[best],
+        "monovision_eye": np.array(monovision_eyes)[idx[0]],
+        "monovision_add": monovision_steps[idx[1]],
+        "re_q": q_steps[idx[2]],
+        "re_refraction": refraction_steps[idx[3]],
+        "le_q": q_steps[idx[4]],
+        "le_refraction": refraction_steps[idx[5]],
+        "binocular_overlap": np.broadcast_to(overlap, score.shape)[idx],
+    }
+
+
+# Clip a convex polygon (N x 2 vertices) to the half-plane a*x + b*y <= c
+def _clip_polygon(poly, a, b, c):
+    if len(poly) == 0:
+        return poly
+    side = poly @ np.array([a, b]) - c
+    out = []
+    for i in range(len(poly)):
+        p, q = poly[i], poly[(i + 1) % len(poly)]
+        sp, sq = side[i], side[(i + 1) % len(poly)]
+        if sp <= 0:
+            out.append(p)
+        if (sp < 0 < sq) or (sq < 0 < sp):
+            out.append(p + (q - p) * (sp / (sp - sq)))
+    return np.array(out).reshape(-1, 2)
+
+
+# Closed-form set of (RE add, LE add) with overlap inside overlap_target that also reach the near line.
+# Every bar endpoint is linear in the adds, so the region is a union of convex polygons: one per
+# branch of the max/min in binocular_overlap and per eye reaching the near line. Returns the list
+# of non-empty polygons (vertex arrays) inside the refraction add slider range. The per-eye
+# Q->DOF factors default to the coefficient set's q_to_dof.
+def feasible_region(re_q, le_q, bia, re_se_dof, le_se_dof, re_mono=0.0, le_mono=0.0,
+                    target=overlap_target, bounds=(0.0, 6.0), re_q_dof_factor=None, le_q_dof_factor=None, coefficients=None):
+    re_q_dof_factor, le_q_dof_factor = _q_dof_factors(coefficients, re_q_dof_factor, le_q_dof_factor)
+    g_re, g_le = re_q * re_q_dof_factor, le_q * le_q_dof_factor
+    a_re, a_le = re_se_dof + bia, le_se_dof + bia
+    low, high = target
+    reach = -near_line
+
+    # With x, y the net shift of each eye: overlap = min(g_re - x, g_le - y) + min(x + a_re, y + a_le)
+    end_branches = [((-1, 1, g_le - g_re), (-1, 0, g_re)), ((1, -1, g_re - g_le), (0, -1, g_le))]
+    start_branches = [((1, -1, a_le - a_re), (1, 0, a_re)), ((-1, 1, a_re - a_le), (0, 1, a_le))]
+    near_options = [[(-1, 0, a_re - reach)], [(0, -1, a_le - reach), (1, 0, reach - a_re)]]
+
+    lo, hi = bounds
+    box = np.array([[lo, lo], [hi, lo], [hi, hi], [lo, hi]], dtype=np.float64)
+    polygons = []
+    for end_cond, end_term in end_branches:
+        for start_cond, start_term in start_branches:
+            px, py = end_term[0] + start_term[0], end_term[1] + start_term[1]
+            const = end_term[2] + start_term[2]
+            base = [end_cond, start_cond, (-px, -py, const - low), (px, py, high - const)]
+            for near in near_options:
+                poly = box
+                for a, b, c in base + near:
+                    # Shift from net shift to refraction add: x = add + monovision
+                    poly = _clip_polygon(poly, a, b, c - a * re_mono - b * le_mono)
+                if len(poly) >= 3:
+                    polygons.append(poly)
+    return polygons
+
+
+# Default scatter scenarios: achieved sphere ±0.5 D per eye, achieved ΔQ ±20 % per eye
+sphere_scatter = np.arange(-0.5, 0.5 + 1e-9, 0.25)
+q_scatter = (0.8, 1.0, 1.2)
+
+
+# Split each eye's net shift back into refraction add + monovision add (monovision on the eye
+# with the larger shift, capped at the monovision slider range)
+def _split_shifts(re_shift, le_shift):
+    diff = re_shift - le_shift
+    mono = np.minimum(np.abs(diff), monovision_steps[-1])
+    eye = np.where(diff > 0, 1, np.where(diff < 0, 2, 0))
+    mono = np.where(eye == 0, 0.0, mono)
+    re_refraction = re_shift - np.where(eye == 1, mono, 0.0)
+    le_refraction = le_shift - np.where(eye == 2, mono, 0.0)
+    return eye, mono, re_refraction, le_refraction
+
+
+# Pick RE/LE add, ΔQ and monovision maximizing worst-case ("worst") or expected ("expected")
+# binocular overlap over a matrix of postoperative scatter scenarios. Overlap above the target is
+# not rewarded and any shortfall from the near line is subtracted, per scenario. Every candidate
+# is scored against all scenarios at once; weights (optional) apply to the "expected" objective.
+def robust_plans(re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, bia, objective="worst", top_n=5,
+                 sphere_scatter=sphere_scatter, q_scatter=q_scatter, weights=None,
+                 pupil=3.0, k=None, treatment_cost=0.01, re_q_dof_factor=None, le_q_dof_factor=None, coefficients=None):
+    if objective not in ("worst", "expected"):
+        raise ValueError(f"Unknown objective: {objective}")
+    re_se_dof, le_se_dof, re_q_dof_factor, le_q_dof_factor = _eye_dofs(
+        re_sphere, re_cyl, le_sphere, le_cyl, sa_re, sa_le, pupil, k, re_q_dof_factor, le_q_dof_factor, coefficients)
+
+    # Scenario axis (last): every combination of per-eye sphere and ΔQ scatter
+    ds_re, ds_le, qs_re, qs_le = (a.ravel() for a in np.meshgrid(sphere_scatter, sphere_scatter, q_scatter, q_scatter, indexing="ij"))
+    if weights is None:
+        weights = np.full(ds_re.size, 1.0 / ds_re.size)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    # Candidate axes: (re_q, le_q, RE net shift, LE net shift)
+    shifts = np.arange(0.0, refraction_steps[-1] + monovision_steps[-1] + 1e-9, 0.25)
+    x = shifts.reshape(-1, 1, 1)
+    y = shifts.reshape(1, -1, 1)
+    le_q = q_steps.reshape(-1, 1, 1, 1)
+    high = overlap_target[1]
+
+    value = np.empty((len(q_steps), len(q_steps), len(shifts), len(shifts)))
+    worst = np.empty_like(value)
+    expected = np.empty_like(value)
+    poor = np.empty_like(value)
+    # One ΔQ(RE) slice at a time keeps the scenario cube small
+    for i, re_q in enumerate(q_steps):
+        _, _, _, re_bia_end, _, re_q_end = bar_endpoints(re_q * qs_re, bia, x + ds_re, 0.0, re_se_dof, re_q_dof_factor)
+        _, _, _, le_bia_end, _, le_q_end = bar_endpoints(le_q * qs_le, bia, y + ds_le, 0.0, le_se_dof, le_q_dof_factor)
+        _, _, overlap = binocular_overlap(re_bia_end, re_q_end, le_bia_end, le_q_end)
+        shortfall = np.maximum(np.minimum(re_bia_end, le_bia_end) - near_line, 0)
+        score = np.minimum(overlap, high) - shortfall
+        worst[i] = overlap.min(axis=-1)
+        expected[i] = overlap @ weights
+        poor[i] = is_poor_fusion(overlap) @ weights
+        value[i] = score.min(axis=-1) if objective == "worst" else score @ weights
+
+    eye, mono, re_refraction, le_refraction = _split_shifts(x[..., 0], y[..., 0])
+    value = value - treatment_cost * (x[..., 0] + y[..., 0])
+    value = np.where(re_refraction <= refraction_steps[-1], value, -np.inf)
+    value = np.where(le_refraction <= refraction_steps[-1], value, -np.inf)
+
+    flat = -value.ravel()
+    top_n = min(top_n, flat.size)
+    best = np.argpartition(flat, top_n - 1)[:top_n]
+    best = best[np.argsort(flat[best], kind="stable")]
+    iq_re, iq_le, ix, iy = np.unravel_index(best, value.shape)
+
+    return {
+        "value": -flat[best],
+        "monovision_eye": np.array(monovision_eyes)[eye[ix, iy]],
+        "monovision_add": mono[ix, iy],
+        "re_q": q_steps[iq_re],
+        "re_refraction": re_refraction[ix, iy],
+        "le_q": q_steps[iq_le],
+        "le_refraction": le_refraction[ix, iy],
+        "worst_overlap": worst[iq_re, iq_le, ix, iy],
+        "expected_overlap": expected[iq_re, iq_le, ix, iy],
+        "p_poor_fusion": poor[iq_re, iq_le, ix, iy],
+    }
+
+
+# Monte Carlo distribution of binocular overlap for one plan. Preop SA, pupil, achieved sphere and
+# achieved ΔQ are perturbed with normal noise and pushed through the DOF + bar model in chunks of
+# chunk_size samples, so memory stays bounded however many samples are drawn. re_shift / le_shift
+# are the planned refraction add + monovision add of each eye. The DOF model and the per-eye
+# Q->DOF factors default to the coefficient set (default_coefficients when None).
+def monte_carlo_plan(se_re, se_le, sa_re, sa_le, bia, re_q, le_q, re_shift, le_shift,
+                     n_samples=1_000_000, sa_sd=0.05, pupil_mean=3.0, pupil_sd=0.5, pupil_range=(2.0, 6.0),
+                     sphere_sd=0.25, q_sd=0.03, k=None, chunk_size=250_000, bins=np.arange(0.0, 6.0 + 1e-9, 0.05),
+                     seed=None, re_q_dof_factor=None, le_q_dof_factor=None, coefficients=None):
+    dof_kwargs = se_dof_kwargs(coefficients, k)
+    re_q_dof_factor, le_q_dof_factor = _q_dof_factors(coefficients, re_q_dof_factor, le_q_dof_factor)
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(len(bins) - 1, dtype=np.int64)
+    total = 0.0
+    n_poor = 0
+    n_none = 0
+
+    done = 0
+    while done < n_samples:
+        n = min(chunk_size, n_samples - done)
+        eyes = []
+        for se, sa, q, shift, q_dof_factor in ((se_re, sa_re, re_q, re_shift, re_q_dof_factor),
+                                               (se_le, sa_le, le_q, le_shift, le_q_dof_factor)):
+            sa_s = np.clip(sa + sa_sd * rng.standard_normal(n), 0.0, None)
+            pupil_s = np.clip(pupil_mean + pupil_sd * rng.standard_normal(n), *pupil_range)
+            shift_s = shift + sphere_sd * rng.standard_normal(n)
+            q_s = np.clip(q + q_sd * rng.standard_normal(n), 0.0, None)
+            se_dof = get_dof_from_se_array(se, sa_s, pupil_s, **dof_kwargs)
+            _, _, _, bia_end, _, q_end = bar_endpoints(q_s, bia, shift_s, 0.0, se_dof, q_dof_factor)
+            eyes.append((bia_end, q_end))
+        _, _, overlap = binocular_overlap(eyes[0][0], eyes[0][1], eyes[1][0], eyes[1][1])
+
+        counts += np.histogram(np.clip(overlap, bins[0], bins[-1]), bins=bins)[0]
+        total += overlap.sum()
+        n_poor += np.count_nonzero(is_poor_fusion(overlap))
+        n_none += np.count_nonzero(overlap <= min_drawn_overlap)
+        done += n
+
+    cdf = np.cumsum(counts) / n_samples
+    percentiles = {p: float(bins[1:][np.searchsorted(cdf, p / 100)]) for p in (5, 25, 50, 75, 95)}
+    return {
+        "n_samples": n_samples,
+        "mean_overlap": float(total / n_samples),
+        "p_poor_fusion": n_poor / n_samples,
+        "p_no_overlap": n_none / n_samples,
+        "percentiles": percentiles,
+        "counts": counts,
+        "bin_edges": bins,
+    }
+
+
+# Named pupil-size histograms (mm -> relative frequency) for expected-DOF integration
+pupil_profiles = {
+    "photopic": {2.0: 0.10, 2.5: 0.25, 3.0: 0.30, 3.5: 0.20, 4.0: 0.10, 4.5: 0.05},
+    "mesopic": {3.5: 0.05, 4.0: 0.15, 4.5: 0.25, 5.0: 0.25, 5.5: 0.20, 6.0: 0.10},
+}
+
+
+def register_pupil_profile(name, histogram):
+    pupil_profiles[name] = dict(histogram)
+    pupil_weight_table.cache_clear()
+
+
+# Pupil sizes and normalized weights of a profile, built once per profile
+@lru_cache(maxsize=None)
+def pupil_weight_table(name):
+    if name not in pupil_profiles:
+        raise ValueError(f"Unknown pupil profile: {name}")
+    sizes = np.array(list(pupil_profiles[name].keys()), dtype=np.float64)
+    weights = np.array(list(pupil_profiles[name].values()), dtype=np.float64)
+    weights = weights / weights.sum()
+    sizes.flags.writeable = False
+    weights.flags.writeable = False
+    return sizes, weights
+
+
+# Expected get_dof_from_se over a pupil profile, vectorized over eyes. The unrounded regression
+# is averaged and the expectation rounded once to the quarter diopter, like the bars.
+def expected_dof_over_pupil(se, sa_preop, profile="photopic", k=_c["sa_k"], slope=_c["se_slope"],
+                            pupil_ref=_c["pupil_ref"], pupil_exponent=_c["pupil_exponent"]):
+    sizes, weights = pupil_weight_table(profile)
+    se = np.asarray(se, dtype=np.float64)[..., np.newaxis]
+    sa_preop = np.asarray(sa_preop, dtype=np.float64)[..., np.newaxis]
+    dof = _se_dof_unrounded(se, sa_preop, sizes, k, slope, pupil_ref, pupil_exponent) @ weights
+    return np.round(dof * 4) / 4
+
+
+# Fine diopter grid over the diagram's x-limits
+defocus_grid = np.linspace(-5.0, 2.0, 701)
+
+
+# Monocular defocus curve (logMAR) from one eye's bars: best acuity between the BIA end and the
+# Q end, degrading by logmar_per_d for each diopter of blur outside that range.
+# Leading dims of the endpoints broadcast against the grid (last axis).
+def monocular_acuity(bia_end, q_end, grid=defocus_grid, best_logmar=0.0, logmar_per_d=0.3):
+    bia_end = np.asarray(bia_end, dtype=np.float64)[..., np.newaxis]
+    q_end = np.asarray(q_end, dtype=np.float64)[..., np.newaxis]
+    blur = np.maximum(bia_end - grid, 0) + np.maximum(grid - q_end, 0)
+    return best_logmar + logmar_per_d * blur
+
+
+# Binocular logMAR by probability summation (Quick pooling of decimal acuity with exponent beta)
+def binocular_summation(logmar_re, logmar_le, beta=4.0):
+    pooled = (10.0 ** (-beta * np.asarray(logmar_re)) + 10.0 ** (-beta * np.asarray(logmar_le))) ** (1 / beta)
+    return -np.log10(pooled)
+
+
+# Longest contiguous range of the grid where logMAR is at or better than threshold: its width
+# (last - first, D) and its first and last vergence (NaN when no grid point qualifies)
+def binocular_range(logmar, threshold=0.2, grid=defocus_grid):
+    good = np.asarray(logmar) <= threshold
+    idx = np.arange(good.shape[-1])
+    # Length of the run of qualifying points ending at each index
+    last_miss = np.maximum.accumulate(np.where(good, -1, idx), axis=-1)
+    run = np.where(good, idx - last_miss, 0)
+    end = np.argmax(run, axis=-1)
+    length = np.take_along_axis(run, end[..., np.newaxis], axis=-1)[..., 0]
+    found = length > 0
+    first = np.where(found, grid[end - np.maximum(length, 1) + 1], np.nan)
+    last = np.where(found, grid[end], np.nan)
+    return np.where(found, last - first, 0.0), first, last
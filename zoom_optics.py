@@ -0,0 +1,161 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Through-focus optics of the ZOOM model: Fourier optics on a pupil with defocus Z(2,0)
+# and spherical aberration Z(4,0), all in float32 / complex64.
+wavelength_um = 0.555
+sa_pupil_mm = 6.0       # corneal SA inputs are measured over 6 mm
+sa_per_q = 1.0          # µm of 6 mm Z(4,0) removed per unit of negative ΔQ
+n_pupil = 64            # samples across the pupil diameter
+n_grid = 128            # FFT size (2x padding so the OTF does not alias)
+vergences = np.arange(2.0, -5.0 - 1e-9, -0.125).astype(np.float32)  # diagram x-limits
+
+
+# Zernike basis on an n_pupil x n_pupil square holding the pupil, built once per pupil size.
+# Only |FFT| is used, so the pupil can sit in the corner of the padded FFT grid.
+@lru_cache(maxsize=8)
+def pupil_basis(pupil=3.0):
+    x = ((np.arange(n_pupil) + 0.5) / n_pupil * 2 - 1).astype(np.float32)
+    xx, yy = np.meshgrid(x, x)
+    rho2 = xx**2 + yy**2
+    mask = (rho2 <= 1.0).astype(np.float32)
+    z20 = np.sqrt(3.0, dtype=np.float32) * (2 * rho2 - 1) * mask
+    z40 = np.sqrt(5.0, dtype=np.float32) * (6 * rho2**2 - 6 * rho2 + 1) * mask
+    for a in (mask, z20, z40):
+        a.flags.writeable = False
+    return mask, z20, z40
+
+
+# Spatial frequency (c/deg) of each rfft2 OTF sample, the neural CSF over that grid, and the
+# weight of each half-plane sample in a sum over the full plane
+@lru_cache(maxsize=8)
+def frequency_grid(pupil=3.0):
+    scale = pupil / n_pupil * 1e-3 / (wavelength_um * 1e-6) * (np.pi / 180)
+    fy = np.fft.fftfreq(n_grid, d=1.0 / n_grid) * scale
+    fx = np.fft.rfftfreq(n_grid, d=1.0 / n_grid) * scale
+    fxx, fyy = np.meshgrid(fx, fy)
+    freq = np.sqrt(fxx**2 + fyy**2).astype(np.float32)
+    # Mannos-Sakrison contrast sensitivity
+    csf = (2.6 * (0.0192 + 0.114 * freq) * np.exp(-(0.114 * freq)**1.1)).astype(np.float32)
+    half = np.full(freq.shape, 2.0, dtype=np.float32)
+    half[:, 0] = 1.0
+    half[:, -1] = 1.0
+    for a in (freq, csf, half):
+        a.flags.writeable = False
+    return freq, csf, half
+
+
+# Z(2,0) coefficient (µm) of a residual myopic defocus in diopters over the pupil
+def defocus_to_c20(defocus, pupil=3.0):
+    return np.asarray(defocus, dtype=np.float32) * (pupil / 2)**2 / (4 * np.sqrt(3.0, dtype=np.float32))
+
+
+# Z(4,0) (µm) over the given pupil from the 6 mm corneal SA input and the Q modulation
+def sa_for_pupil(sa_6mm, q_delta, pupil=3.0):
+    sa = np.asarray(sa_6mm, dtype=np.float32) - sa_per_q * np.asarray(q_delta, dtype=np.float32)
+    return sa * np.float32((pupil / sa_pupil_mm)**4)
+
+
+# Stack of PSFs (one per c20 value) normalized to unit energy, origin at [0, 0]
+def psf_stack(c20, c40, pupil=3.0):
+    mask, z20, z40 = pupil_basis(pupil)
+    c20 = np.asarray(c20, dtype=np.float32).reshape(-1, 1, 1)
+    phase = (2 * np.pi / wavelength_um) * (c20 * z20 + np.float32(c40) * z40)
+    field = mask * np.exp(1j * phase.astype(np.float32))
+    # Zero rows of the padding contribute nothing, so transform the pupil rows first
+    field = np.fft.fft(field, n=n_grid, axis=-1)
+    field = np.fft.fft(field, n=n_grid, axis=-2)
+    psf = field.real**2 + field.imag**2
+    psf /= psf.sum(axis=(-2, -1), keepdims=True)
+    return psf.astype(np.float32)
+
+
+# MTF on the rfft2 half plane (the PSF is real)
+def _mtf(psf):
+    return np.abs(np.fft.rfft2(psf)).astype(np.float32)
+
+
+# CSF and band-limit weights over the half plane, with the diffraction-limited totals
+@lru_cache(maxsize=8)
+def _metric_weights(pupil=3.0, max_freq=60.0):
+    freq, csf, half = frequency_grid(pupil)
+    vs_weight = csf * half
+    area_weight = ((freq <= max_freq) * half).astype(np.float32)
+    mtf = _mtf(psf_stack(0.0, 0.0, pupil))[0]
+    return vs_weight, area_weight, float((mtf * vs_weight).sum()), float((mtf * area_weight).sum())
+
+
+# Through-focus curve over object vergence (D, negative = near) for one eye.
+# shift is the eye's planned myopic shift (refraction add + monovision), so the eye is in focus
+# at vergence -shift. metric is "vsmtf" (visual Strehl, CSF-weighted MTF) or "mtf_area" (up to
+# max_freq c/deg); both are relative to the diffraction-limited eye.
+def through_focus(sa_6mm, q_delta, shift=0.0, pupil=3.0, vergence=vergences, metric="vsmtf", max_freq=60.0):
+    if metric not in ("vsmtf", "mtf_area"):
+        raise ValueError(f"Unknown metric: {metric}")
+    c20 = defocus_to_c20(np.asarray(vergence) + shift, pupil)
+    c40 = sa_for_pupil(sa_6mm, q_delta, pupil)
+    mtf = _mtf(psf_stack(c20, c40, pupil))
+
+    vs_weight, area_weight, dl_vs, dl_area = _metric_weights(pupil, max_freq)
+    if metric == "vsmtf":
+        return (mtf * vs_weight).sum(axis=(-2, -1)) / np.float32(dl_vs)
+    return (mtf * area_weight).sum(axis=(-2, -1)) / np.float32(dl_area)
+
+
+# Angular size (arcmin) of one PSF sample for a given pupil
+def psf_sample_arcmin(pupil=3.0):
+    dx = pupil / n_pupil * 1e-3
+    return wavelength_um * 1e-6 / (n_grid * dx) * (180 / np.pi) * 60
+
+
+# Tumbling-E chart (1 = white, 0 = black) at the PSF sampling of the pupil.
+# One row per acuity level; stroke width is 1 arcmin at 20/20.
+@lru_cache(maxsize=8)
+def optotype_chart(pupil=3.0, size=256, acuities=(20 / 60, 20 / 40, 20 / 30, 20 / 20)):
+    chart = np.ones((size, size), dtype=np.float32)
+    px = psf_sample_arcmin(pupil)
+    y = size // 16
+    for row, acuity in enumerate(acuities):
+        stroke = max(1, int(round(1.0 / acuity / px)))
+        letter = 5 * stroke
+        e = np.zeros((letter, letter), dtype=np.float32)
+        e[stroke:2 * stroke, stroke:] = 1
+        e[3 * stroke:4 * stroke, stroke:] = 1
+        gap = letter
+        n = max(1, (size - gap) // (letter + gap))
+        x = (size - n * letter - (n - 1) * gap) // 2
+        for i in range(n):
+            if y + letter > size:
+                break
+            chart[y:y + letter, x:x + letter] = np.rot90(e, (row + i) % 4)
+            x += letter + gap
+        y += letter + max(letter, size // 16)
+    chart.flags.writeable = False
+    return chart
+
+
+# Transfer function of one eye's PSF padded to the chart shape. Keyed by the quantized optical
+# parameters so unchanged eyes and vergences come straight from the cache.
+@lru_cache(maxsize=64)
+def _kernel_otf(c20_q, c40_q, pupil, shape):
+    psf = psf_stack(c20_q / 1000, c40_q / 1000, pupil)[0]
+    psf = np.fft.fftshift(psf)
+    padded = np.zeros(shape, dtype=np.float32)
+    r0, c0 = (shape[0] - n_grid) // 2, (shape[1] - n_grid) // 2
+    padded[r0:r0 + n_grid, c0:c0 + n_grid] = psf
+    otf = np.fft.rfft2(np.fft.ifftshift(padded)).astype(np.complex64)
+    otf.flags.writeable = False
+    return otf
+
+
+# Chart as seen by one eye at the given object vergence (D), convolved in the Fourier domain
+def retinal_image(sa_6mm, q_delta, shift=0.0, vergence=0.0, pupil=3.0, chart=None):
+    if chart is None:
+        chart = optotype_chart(pupil)
+    c20 = float(defocus_to_c20(vergence + shift, pupil))
+    c40 = float(sa_for_pupil(sa_6mm, q_delta, pupil))
+    # Quantize to 0.001 µm of wavefront
+    otf = _kernel_otf(int(round(c20 * 1000)), int(round(c40 * 1000)), pupil, chart.shape)
+    image = np.fft.irfft2(np.fft.rfft2(chart) * otf, s=chart.shape)
+    return np.clip(image, 0.0, 1.0).astype(np.float32)